@@ -0,0 +1,203 @@
+import signal
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut, Unauthorized
+import logging
+
+from shop.imaging import open_for_telegram
+from shop.models import Broadcast
+
+from .instrumentation import InstrumentedRequest
+from .ratelimit import RateLimiter
+from .user_cache import invalidate_user_context
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+Recipient = namedtuple('Recipient', ['user_id', 'telegram_id', 'language'])
+ChunkResult = namedtuple('ChunkResult', ['last_user_id', 'sent', 'failed', 'blocked'])
+
+MAX_ATTEMPTS = 3
+
+
+def iter_recipient_chunks(after_user_id=0, chunk_size=500):
+    """Active bot users with an id above after_user_id in id order, chunk_size at a time
+
+    Rows are streamed with a server-side cursor, so memory stays flat whatever
+    the number of users.
+    """
+    recipients = (
+        User.objects.filter(is_active_bot=True, telegram_id__isnull=False, id__gt=after_user_id)
+        .order_by('id')
+        .values_list('id', 'telegram_id', 'language')
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = []
+    for row in recipients:
+        chunk.append(Recipient(*row))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def is_blocked(error):
+    """Whether a Telegram error means the user cannot receive messages from the bot any more"""
+    if isinstance(error, Unauthorized):
+        return True
+    return isinstance(error, BadRequest) and 'chat not found' in error.message.lower()
+
+
+def deactivate(recipients):
+    """Stop messaging users who blocked the bot"""
+    if not recipients:
+        return
+    User.objects.filter(pk__in=[recipient.user_id for recipient in recipients]).update(is_active_bot=False)
+    for recipient in recipients:
+        invalidate_user_context(recipient.telegram_id)
+
+
+class BroadcastSender:
+    """Sends one broadcast to recipients within the shared Telegram rate limit
+
+    send_chunk does not touch the database, so worker processes need no
+    connection: recipients who blocked the bot are returned in
+    ChunkResult.blocked for the caller to deactivate.
+    """
+
+    def __init__(self, broadcast, bot, limiter):
+        self.broadcast = broadcast
+        self.bot = bot
+        self.limiter = limiter
+
+    def deliver(self, recipient):
+        text = self.broadcast.get_text(recipient.language)
+        self.limiter.acquire()
+        if self.broadcast.image_file_id:
+            return self.bot.send_photo(chat_id=recipient.telegram_id, photo=self.broadcast.image_file_id, caption=text)
+        return self.bot.send_message(chat_id=recipient.telegram_id, text=text)
+
+    def deliver_upload(self, recipient):
+        upload = open_for_telegram(self.broadcast, 'image', 'image_variants')
+        try:
+            self.limiter.acquire()
+            return self.bot.send_photo(
+                chat_id=recipient.telegram_id, photo=upload, caption=self.broadcast.get_text(recipient.language)
+            )
+        finally:
+            upload.close()
+
+    @staticmethod
+    def with_retries(deliver, recipient):
+        """Call deliver(recipient), waiting out flood limits and retrying network errors
+
+        Raises the last error after MAX_ATTEMPTS. TimedOut is raised at once: the
+        message may have gone out, and sending it again could duplicate it.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return deliver(recipient)
+            except TimedOut:
+                raise
+            except RetryAfter as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(e.retry_after)
+            except NetworkError:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def send(self, recipient):
+        """Send to one recipient: 'sent', 'blocked' or 'failed'; retries flood waits and network errors"""
+        try:
+            self.with_retries(self.deliver, recipient)
+            return 'sent'
+        except TimedOut:
+            return 'failed'
+        except (Unauthorized, BadRequest) as e:
+            if is_blocked(e):
+                return 'blocked'
+            logger.warning(f"Broadcast {self.broadcast.id} rejected for user {recipient.user_id}: {str(e)}")
+            return 'failed'
+        except TelegramError as e:
+            logger.warning(f"Broadcast {self.broadcast.id} failed for user {recipient.user_id}: {str(e)}")
+            return 'failed'
+
+    def send_chunk(self, chunk):
+        sent = failed = 0
+        blocked = []
+        for recipient in chunk:
+            result = self.send(recipient)
+            if result == 'sent':
+                sent += 1
+            elif result == 'blocked':
+                blocked.append(recipient)
+            else:
+                failed += 1
+
+        return ChunkResult(chunk[-1].user_id, sent, failed, blocked)
+
+    def upload_image(self, recipients):
+        """Send to recipients until the image is uploaded once, and keep its file_id for the rest
+
+        Flood waits and network errors are retried as in send; a recipient the upload
+        still fails for is counted as failed and the next one is tried. Returns the
+        ChunkResult of the recipients it went through.
+        """
+        broadcast = self.broadcast
+        sent = failed = 0
+        blocked = []
+        last_user_id = None
+        for recipient in recipients:
+            last_user_id = recipient.user_id
+            try:
+                message = self.with_retries(self.deliver_upload, recipient)
+            except (Unauthorized, BadRequest) as e:
+                if is_blocked(e):
+                    blocked.append(recipient)
+                    continue
+                raise
+            except (RetryAfter, NetworkError) as e:
+                logger.warning(f"Broadcast {broadcast.id} image upload failed for user {recipient.user_id}: {str(e)}")
+                failed += 1
+                continue
+
+            sent += 1
+            broadcast.image_file_id = message.photo[-1].file_id
+            # update() skips the signals that would clear the file_id again
+            Broadcast.objects.filter(pk=broadcast.pk, image=broadcast.image.name).update(
+                image_file_id=broadcast.image_file_id
+            )
+            break
+
+        return ChunkResult(last_user_id, sent, failed, blocked)
+
+
+# Worker process state, set up once per process by init_worker
+_sender = None
+
+
+def make_sender(broadcast):
+    bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=InstrumentedRequest(con_pool_size=2))
+    return BroadcastSender(broadcast, bot, RateLimiter())
+
+
+def init_worker(broadcast_id):
+    global _sender
+    # Ctrl-C reaches the whole process group but the parent decides when to stop;
+    # drop the parent's SIGTERM handler so Pool.terminate() still works
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _sender = make_sender(Broadcast.objects.get(pk=broadcast_id))
+    connection.close()
+
+
+def send_chunk(chunk):
+    return _sender.send_chunk(chunk)
@@ -0,0 +1,72 @@
+import functools
+import threading
+from collections import deque
+
+from django.db import close_old_connections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserExecutor:
+    """Run handler callbacks on the dispatcher's worker threads, one update per user at a time
+
+    Updates from different users are handled concurrently; updates from the same
+    user are queued and handled in arrival order on a single worker, so a user's
+    taps never race each other (cart writes, order placement).
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def wrap(self, callback):
+        @functools.wraps(callback)
+        def wrapper(update, context):
+            self.submit(callback, update, context)
+
+        return wrapper
+
+    def submit(self, callback, update, context):
+        user = getattr(update, 'effective_user', None)
+        key = user.id if user else None
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((callback, update, context))
+                return
+            self._queues[key] = deque([(callback, update, context)])
+
+        context.dispatcher.run_async(self._drain, key, context.dispatcher, update=update)
+
+    def _drain(self, key, dispatcher):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    self._idle.notify_all()
+                    return
+                callback, update, context = queue.popleft()
+
+            close_old_connections()
+            try:
+                callback(update, context)
+            except Exception as e:
+                try:
+                    dispatcher.dispatch_error(update, e)
+                except Exception:
+                    logger.exception('An uncaught error was raised while handling the error.')
+            finally:
+                close_old_connections()
+
+    def pending(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued update has been handled"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
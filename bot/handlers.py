@@ -1,8 +1,21 @@
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Updater, CommandHandler, MessageHandler, CallbackQueryHandler, Filters
+from telegram import (
+    Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+)
+from telegram.ext import Updater, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, Filters
 from django.contrib.auth import get_user_model
-from shop.models import Category, Product, ProductColor, Cart, Order, OrderItem
-from .utils import get_text, create_main_keyboard, create_categories_keyboard, create_products_keyboard
+from shop.models import Category, Product, ProductColor, Cart, Order
+from shop.catalog import get_category_tree, get_product_page
+from shop.search import search_product_ids
+from shop.services import build_cart_summary, place_order
+from .utils import (
+    get_text, format_text, format_cart, MENU_PATTERNS, create_main_keyboard,
+    create_categories_keyboard, create_products_keyboard, create_cart_keyboard
+)
+from .inline_index import get_inline_index
+from .instrumentation import instrument_handler
+from .media import reply_photo
+from .user_cache import get_user_context, remember_user
 import logging
 from django.conf import settings
 User = get_user_model()
@@ -26,19 +39,20 @@ def start(update, context):
 
     context.user_data['language'] = user.language
     context.user_data['user_id'] = user.id
+    remember_user(user)
 
     if created or not user.phone_number:
         keyboard = [[KeyboardButton(get_text('share_contact', user.language), request_contact=True)]]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
         update.message.reply_text(
-            get_text('welcome_new_user', user.language).format(name=telegram_user.first_name),
+            format_text('welcome_new_user', user.language, name=telegram_user.first_name),
             reply_markup=reply_markup
         )
     else:
         reply_markup = create_main_keyboard(user.language)
         update.message.reply_text(
-            get_text('welcome_back', user.language).format(name=user.first_name),
+            format_text('welcome_back', user.language, name=user.first_name),
             reply_markup=reply_markup
         )
 
@@ -51,6 +65,7 @@ def contact_handler(update, context):
             user = User.objects.get(telegram_id=update.effective_user.id)
             user.phone_number = contact.phone_number
             user.save()
+            remember_user(user)
 
             reply_markup = create_main_keyboard(user.language)
             update.message.reply_text(
@@ -65,14 +80,15 @@ def contact_handler(update, context):
 def categories_handler(update, context):
     """Show categories"""
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
         # Get root categories
-        categories = Category.objects.filter(parent__isnull=True, is_active=True).order_by('order')
+        tree = get_category_tree()
+        categories = tree.roots(language)
 
-        if categories.exists():
-            reply_markup = create_categories_keyboard(categories, language)
+        if categories:
+            reply_markup = create_categories_keyboard(categories, language, version=tree.version)
             update.message.reply_text(
                 get_text('select_category', language),
                 reply_markup=reply_markup
@@ -89,29 +105,27 @@ def category_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
         category_id = int(query.data.split('_')[1])
-        category = Category.objects.get(id=category_id, is_active=True)
+        tree = get_category_tree()
+        category = tree.get(category_id)
 
-        subcategories = category.children.filter(is_active=True).order_by('order')
+        subcategories = category.get_children(language)
 
-        if subcategories.exists():
-            reply_markup = create_categories_keyboard(subcategories, language, parent_id=category.id)
+        if subcategories:
+            reply_markup = create_categories_keyboard(
+                subcategories, language, parent_id=category.id, version=tree.version,
+                browse_all=settings.BOT_BROWSE_SUBTREE
+            )
             query.edit_message_text(
-                get_text('select_subcategory', language).format(category=category.get_name(language)),
+                format_text('select_subcategory', language, category=category.get_name(language)),
                 reply_markup=reply_markup
             )
         else:
-            products = category.products.filter(is_active=True)[:10]
-
-            if products.exists():
-                reply_markup = create_products_keyboard(products, language)
-                query.edit_message_text(
-                    get_text('products_in_category', language).format(category=category.get_name(language)),
-                    reply_markup=reply_markup
-                )
+            if category.product_count:
+                show_products_page(query, category, language, tree)
             else:
                 query.edit_message_text(get_text('no_products_in_category', language))
 
@@ -120,13 +134,51 @@ def category_callback(update, context):
     except User.DoesNotExist:
         query.edit_message_text(get_text('error_user_not_found', 'uz'))
 
+def show_products_page(query, category, language, tree, cursor=None, backwards=False):
+    """Edit the message into one page of a category's products"""
+    reply_markup = create_products_keyboard(
+        lambda: get_product_page(category, cursor=cursor, backwards=backwards),
+        language, category_id=category.id, version=tree.version,
+        cursor=(backwards, cursor)
+    )
+    query.edit_message_text(
+        format_text('products_in_category', language, category=category.get_name(language)),
+        reply_markup=reply_markup
+    )
+
+def product_page_callback(update, context):
+    """Handle product list paging: pp_{category} or pp_{category}_{n|p}_{created_at_us}_{id}"""
+    query = update.callback_query
+    query.answer()
+
+    try:
+        user = get_user_context(update.effective_user.id)
+        language = user.language
+
+        parts = query.data.split('_')
+        tree = get_category_tree()
+        category = tree.get(int(parts[1]))
+
+        cursor = None
+        backwards = False
+        if len(parts) == 5:
+            backwards = parts[2] == 'p'
+            cursor = (int(parts[3]), int(parts[4]))
+
+        show_products_page(query, category, language, tree, cursor=cursor, backwards=backwards)
+
+    except (Category.DoesNotExist, ValueError, IndexError):
+        query.edit_message_text(get_text('error_category_not_found', 'uz'))
+    except User.DoesNotExist:
+        query.edit_message_text(get_text('error_user_not_found', 'uz'))
+
 def product_callback(update, context):
     """Handle product selection"""
     query = update.callback_query
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
         product_id = int(query.data.split('_')[1])
@@ -150,8 +202,8 @@ def product_callback(update, context):
             text += get_text('select_color', language)
 
             if product.main_image:
-                query.message.reply_photo(
-                    photo=product.main_image,
+                reply_photo(
+                    query.message, product, 'main_image', 'main_image_file_id', 'main_image_variants',
                     caption=text,
                     parse_mode='Markdown',
                     reply_markup=reply_markup
@@ -171,14 +223,14 @@ def color_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
         color_id = int(query.data.split('_')[1])
         color = ProductColor.objects.get(id=color_id, is_available=True)
 
         cart_item, created = Cart.objects.get_or_create(
-            user=user,
+            user_id=user.user_id,
             product_color=color,
             defaults={'quantity': 1}
         )
@@ -195,7 +247,8 @@ def color_callback(update, context):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        text = get_text('item_added_to_cart', language).format(
+        text = format_text(
+            'item_added_to_cart', language,
             product=color.product.get_name(language),
             color=color.get_name(language),
             price=color.price
@@ -204,10 +257,9 @@ def color_callback(update, context):
         # Rangga xos rasmni olish
         color_image = color.images.first()
         if color_image:
-            image_url = f"{settings.SITE_URL}{color_image.image.url}"
             try:
-                query.message.reply_photo(
-                    photo=image_url,
+                reply_photo(
+                    query.message, color_image, 'image', 'file_id', 'image_variants',
                     caption=text,
                     parse_mode='Markdown',
                     reply_markup=reply_markup
@@ -226,30 +278,14 @@ def color_callback(update, context):
 def cart_handler(update, context):
     """Show cart contents"""
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
-        cart_items = Cart.objects.filter(user=user)
-
-        if cart_items.exists():
-            text = get_text('your_cart', language) + "\n\n"
-            total = 0
+        summary = build_cart_summary(user.user_id)
 
-            for item in cart_items:
-                item_total = item.total_price
-                total += item_total
-                text += f"• {item.product_color.product.get_name(language)}\n"
-                text += f"  {item.product_color.get_name(language)}\n"
-                text += f"  {item.quantity} x {item.product_color.price} = {item_total} so'm\n\n"
-
-            text += f"*{get_text('total', language)}: {total} so'm*"
-
-            keyboard = [
-                [InlineKeyboardButton(get_text('place_order', language), callback_data="place_order")],
-                [InlineKeyboardButton(get_text('clear_cart', language), callback_data="clear_cart")],
-                [InlineKeyboardButton(get_text('continue_shopping', language), callback_data="back_to_categories")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        if summary.items:
+            text = format_cart(summary, language)
+            reply_markup = create_cart_keyboard(language)
 
             update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
         else:
@@ -264,30 +300,14 @@ def view_cart_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
-        cart_items = Cart.objects.filter(user=user)
+        summary = build_cart_summary(user.user_id)
 
-        if cart_items.exists():
-            text = get_text('your_cart', language) + "\n\n"
-            total = 0
-
-            for item in cart_items:
-                item_total = item.total_price
-                total += item_total
-                text += f"• {item.product_color.product.get_name(language)}\n"
-                text += f"  {item.product_color.get_name(language)}\n"
-                text += f"  {item.quantity} x {item.product_color.price} = {item_total} so'm\n\n"
-
-            text += f"*{get_text('total', language)}: {total} so'm*"
-
-            keyboard = [
-                [InlineKeyboardButton(get_text('place_order', language), callback_data="place_order")],
-                [InlineKeyboardButton(get_text('clear_cart', language), callback_data="clear_cart")],
-                [InlineKeyboardButton(get_text('continue_shopping', language), callback_data="back_to_categories")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        if summary.items:
+            text = format_cart(summary, language)
+            reply_markup = create_cart_keyboard(language)
 
             query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
         else:
@@ -302,35 +322,20 @@ def place_order_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
-        cart_items = Cart.objects.filter(user=user)
-
-        if cart_items.exists():
-            total = sum(item.total_price for item in cart_items)
-
-            order = Order.objects.create(
-                user=user,
-                total_amount=total,
-                phone_number=user.phone_number or '',
-                status='pending'
-            )
-
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product_color=cart_item.product_color,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product_color.price
-                )
-
-            # Clear cart
-            cart_items.delete()
+        order = place_order(
+            user.user_id,
+            phone_number=user.phone_number,
+            idempotency_key=f"callback:{query.id}"
+        )
 
-            text = get_text('order_created', language).format(
+        if order:
+            text = format_text(
+                'order_created', language,
                 order_id=order.id,
-                total=total
+                total=order.total_amount
             )
 
             query.edit_message_text(text)
@@ -346,10 +351,10 @@ def clear_cart_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
-        Cart.objects.filter(user=user).delete()
+        Cart.objects.filter(user_id=user.user_id).delete()
 
         query.edit_message_text(get_text('cart_cleared', language))
 
@@ -359,7 +364,7 @@ def clear_cart_callback(update, context):
 def language_handler(update, context):
     """Handle language selection"""
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        get_user_context(update.effective_user.id)
 
         keyboard = [
             [InlineKeyboardButton("🇺🇿 O'zbek", callback_data="lang_uz")],
@@ -386,6 +391,7 @@ def language_callback(update, context):
         language = query.data.split('_')[1]
         user.language = language
         user.save()
+        remember_user(user)
 
         context.user_data['language'] = language
 
@@ -404,13 +410,14 @@ def back_to_categories_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
-        categories = Category.objects.filter(parent__isnull=True, is_active=True).order_by('order')
+        tree = get_category_tree()
+        categories = tree.roots(language)
 
-        if categories.exists():
-            reply_markup = create_categories_keyboard(categories, language)
+        if categories:
+            reply_markup = create_categories_keyboard(categories, language, version=tree.version)
             query.edit_message_text(
                 get_text('select_category', language),
                 reply_markup=reply_markup
@@ -427,15 +434,13 @@ def orders_handler(update, context):
         telegram_id = update.effective_user.id
         logger.info(f"Fetching orders for Telegram ID: {telegram_id}")
 
-        user = User.objects.get(telegram_id=telegram_id)
-        logger.info(f"User found: {user.username}, Language: {user.language}")
+        user = get_user_context(telegram_id)
+        logger.info(f"User found: {user.user_id}, Language: {user.language}")
 
         language = user.language
-        orders = Order.objects.filter(user=user).order_by('-created_at')
-        logger.info(f"Orders found: {list(orders)}")
+        orders = list(Order.objects.filter(user_id=user.user_id).order_by('-created_at'))
 
-        if orders.exists():
-            logger.info("Orders exist, building response")
+        if orders:
             text = get_text('your_orders', language) + "\n\n"
             for order in orders:
                 status_text = get_text(f'order_status_{order.status}', language)
@@ -449,7 +454,7 @@ def orders_handler(update, context):
                 if order.status == 'pending':
                     keyboard.append([
                         InlineKeyboardButton(
-                            get_text('cancel_order', language).format(order_id=order.id),
+                            format_text('cancel_order', language, order_id=order.id),
                             callback_data=f"cancel_order_{order.id}"
                         )
                     ])
@@ -474,17 +479,18 @@ def cancel_order_callback(update, context):
     query.answer()
 
     try:
-        user = User.objects.get(telegram_id=update.effective_user.id)
+        user = get_user_context(update.effective_user.id)
         language = user.language
 
         order_id = int(query.data.split('_')[2])
-        order = Order.objects.get(id=order_id, user=user, status='pending')
+        order = Order.objects.get(id=order_id, user_id=user.user_id, status='pending')
 
-        order.status = 'cancelled'
+        # The customer is answered right here, no status notification needed
+        order.status = order.notified_status = 'cancelled'
         order.save()
 
         query.edit_message_text(
-            get_text('order_cancelled', language).format(order_id=order.id)
+            format_text('order_cancelled', language, order_id=order.id)
         )
 
     except (Order.DoesNotExist, ValueError, IndexError):
@@ -493,31 +499,110 @@ def cancel_order_callback(update, context):
         query.edit_message_text(get_text('error_user_not_found', 'uz'))
 
 
-def setup_handlers(dispatcher):
-    """Setup all bot handlers"""
+def search_handler(update, context):
+    """Search products by free text"""
+    logger.info(f"Received message: {update.message.text} from user {update.effective_user.id}")
+
+    try:
+        user = get_user_context(update.effective_user.id)
+        language = user.language
+
+        term = update.message.text.strip()
+        if len(term) < 2:
+            return
+
+        ids = search_product_ids(term)[:settings.BOT_PRODUCTS_PAGE_SIZE]
+        if not ids:
+            update.message.reply_text(format_text('search_no_results', language, query=term))
+            return
+
+        products = Product.objects.only('id', 'name_uz', 'name_ru').in_bulk(ids)
+        reply_markup = create_products_keyboard(
+            ([products[pk] for pk in ids if pk in products], None, None), language
+        )
+        update.message.reply_text(
+            format_text('search_results', language, query=term),
+            reply_markup=reply_markup
+        )
+
+    except User.DoesNotExist:
+        update.message.reply_text(get_text('error_user_not_found', 'uz'))
+
+def inline_query_handler(update, context):
+    """Answer inline queries from the in-memory product index"""
+    inline_query = update.inline_query
+
+    try:
+        language = get_user_context(update.effective_user.id).language
+    except User.DoesNotExist:
+        language = 'ru' if (update.effective_user.language_code or '').startswith('ru') else 'uz'
+
+    # The offset comes back from the client as sent, but is not to be trusted
+    try:
+        offset = max(0, int(inline_query.offset or 0))
+    except ValueError:
+        offset = 0
+    page_size = 50
+    entries = get_inline_index().search(inline_query.query, offset=offset, limit=page_size)
+
+    results = []
+    for entry in entries:
+        name = entry.name_ru if language == 'ru' else entry.name_uz
+        price = format_text('price_from', language, price=entry.price) if entry.price is not None else ''
+        text = f"{name}\n{price}" if price else name
+        if entry.file_id:
+            results.append(InlineQueryResultCachedPhoto(
+                id=str(entry.id), photo_file_id=entry.file_id, title=name, description=price, caption=text
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=str(entry.id), title=name, description=price,
+                input_message_content=InputTextMessageContent(text)
+            ))
+
+    inline_query.answer(
+        results,
+        cache_time=settings.BOT_INLINE_CACHE_TIME,
+        next_offset=str(offset + page_size) if len(entries) == page_size else ''
+    )
+
+def setup_handlers(dispatcher, executor=None):
+    """Setup all bot handlers
+
+    With an executor (bot.concurrency.PerUserExecutor) the handlers run on the
+    dispatcher's worker threads instead of the dispatcher thread.
+    """
     logger.info("Setting up bot handlers")
 
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("orders", orders_handler))
-    dispatcher.add_handler(MessageHandler(Filters.contact, contact_handler))
-    dispatcher.add_handler(MessageHandler(Filters.regex(r'^(🛍\s*Kategoriyalar|Категории)$'), categories_handler))
-    dispatcher.add_handler(MessageHandler(Filters.regex(r'^(🛒\s*Savatcha|Корзина)$'), cart_handler))
-    dispatcher.add_handler(MessageHandler(Filters.regex(r'^(🌐\s*Til|Язык)$'), language_handler))
-    dispatcher.add_handler(MessageHandler(Filters.regex(r'^(Mening buyurtmalarim|Мои заказы)$'), orders_handler))
-
-    dispatcher.add_handler(CallbackQueryHandler(category_callback, pattern='^cat_'))
-    dispatcher.add_handler(CallbackQueryHandler(product_callback, pattern='^prod_'))
-    dispatcher.add_handler(CallbackQueryHandler(color_callback, pattern='^color_'))
-    dispatcher.add_handler(CallbackQueryHandler(view_cart_callback, pattern='^view_cart$'))
-    dispatcher.add_handler(CallbackQueryHandler(place_order_callback, pattern='^place_order$'))
-    dispatcher.add_handler(CallbackQueryHandler(clear_cart_callback, pattern='^clear_cart$'))
-    dispatcher.add_handler(CallbackQueryHandler(language_callback, pattern='^lang_'))
-    dispatcher.add_handler(CallbackQueryHandler(back_to_categories_callback, pattern='^back_to_categories$'))
-    dispatcher.add_handler(CallbackQueryHandler(cancel_order_callback, pattern='^cancel_order_'))
-
-    def log_message(update, context):
-        logger.info(f"Received message: {update.message.text} from user {update.effective_user.id}")
-
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, log_message))
-
-    logger.info("All handlers set up successfully")
\ No newline at end of file
+    def wrap(callback):
+        callback = instrument_handler(callback)
+        return executor.wrap(callback) if executor else callback
+
+    dispatcher.add_handler(CommandHandler("start", wrap(start)))
+    dispatcher.add_handler(CommandHandler("orders", wrap(orders_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.contact, wrap(contact_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.regex(MENU_PATTERNS['categories']), wrap(categories_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.regex(MENU_PATTERNS['cart']), wrap(cart_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.regex(MENU_PATTERNS['language']), wrap(language_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.regex(MENU_PATTERNS['orders']), wrap(orders_handler)))
+
+    dispatcher.add_handler(CallbackQueryHandler(wrap(category_callback), pattern=r'^cat_\d+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(product_page_callback), pattern=r'^pp_\d+(_[np]_\d+_\d+)?$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(product_callback), pattern=r'^prod_\d+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(color_callback), pattern=r'^color_\d+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(view_cart_callback), pattern='^view_cart$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(place_order_callback), pattern='^place_order$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(clear_cart_callback), pattern='^clear_cart$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(language_callback), pattern=r'^lang_(uz|ru)$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(back_to_categories_callback), pattern='^back_to_categories$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(cancel_order_callback), pattern=r'^cancel_order_\d+$'))
+
+    dispatcher.add_handler(InlineQueryHandler(wrap(inline_query_handler)))
+
+    # Any other text is a product search
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, wrap(search_handler)))
+
+    # Build the inline index now rather than on the first inline query
+    get_inline_index()
+
+    logger.info("All handlers set up successfully")
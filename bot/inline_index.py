@@ -0,0 +1,192 @@
+import re
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+import logging
+
+from shop.catalog import get_catalog_version
+from shop.models import Product, ProductColor, ProductColorImage
+
+logger = logging.getLogger(__name__)
+
+InlineEntry = namedtuple('InlineEntry', ['id', 'name_uz', 'name_ru', 'price', 'file_id'])
+
+# Uzbek Latin is typed with any of these for o‘ and g‘
+APOSTROPHES = re.compile(r"['‘’ʻʼ`]")
+WORDS = re.compile(r'\w+')
+
+# Prefixes indexed per word: a one letter prefix matches most of the catalog, and
+# longer prefixes add little but memory; query words are cut to MAX_PREFIX
+MIN_PREFIX = 2
+MAX_PREFIX = 12
+FUZZY_THRESHOLD = 0.3
+
+
+def tokenize(text):
+    return WORDS.findall(APOSTROPHES.sub('', text.casefold()))
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InlineIndex:
+    """Immutable in-memory search index of active products for inline queries
+
+    Words of product and color names in both languages are indexed by prefix
+    (for search-as-you-type) and by trigram (for typos), so a query is answered
+    with a few dict lookups and no database access. Posting lists are stored as
+    tuples once built, which takes a fraction of the memory of sets.
+    """
+
+    def __init__(self, entries, words, version=None):
+        self.version = version
+        self.entries = entries
+        # Newest first, used for an empty query
+        self.newest = tuple(sorted(entries, reverse=True))
+
+        exact = {}
+        prefixes = {}
+        grams_words = {}
+        self._trigram_counts = {}
+        for product_id, text in words:
+            for token in tokenize(text):
+                exact.setdefault(token, set()).add(product_id)
+                for length in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+                    prefixes.setdefault(token[:length], set()).add(product_id)
+                # Fuzzy matching only runs for query words of three letters or more
+                if len(token) >= 3 and token not in self._trigram_counts:
+                    grams = trigrams(token)
+                    self._trigram_counts[token] = len(grams)
+                    for gram in grams:
+                        grams_words.setdefault(gram, set()).add(token)
+
+        self._exact = {token: tuple(ids) for token, ids in exact.items()}
+        self._prefixes = {prefix: tuple(ids) for prefix, ids in prefixes.items()}
+        self._trigrams = {gram: tuple(tokens) for gram, tokens in grams_words.items()}
+
+    @classmethod
+    def build(cls, version=None):
+        entries = {}
+        words = []
+
+        for row in Product.objects.filter(is_active=True).values('id', 'name_uz', 'name_ru', 'main_image_file_id'):
+            entries[row['id']] = [row['name_uz'], row['name_ru'], None, row['main_image_file_id']]
+            words.append((row['id'], row['name_uz']))
+            words.append((row['id'], row['name_ru']))
+
+        colors = ProductColor.objects.filter(is_available=True, product__is_active=True)
+        for product_id, name_uz, name_ru, price in colors.values_list('product_id', 'name_uz', 'name_ru', 'price'):
+            entry = entries[product_id]
+            if entry[2] is None or price < entry[2]:
+                entry[2] = price
+            words.append((product_id, name_uz))
+            words.append((product_id, name_ru))
+
+        images = (
+            ProductColorImage.objects.filter(color__in=colors).exclude(file_id='')
+            .order_by('order', 'id').values_list('color__product_id', 'file_id')
+        )
+        for product_id, file_id in images:
+            if not entries[product_id][3]:
+                entries[product_id][3] = file_id
+
+        entries = {product_id: InlineEntry(product_id, *entry) for product_id, entry in entries.items()}
+        return cls(entries, words, version=version)
+
+    def _match(self, token):
+        """Scores of products matching one query token"""
+        scores = {}
+        for product_id in self._prefixes.get(token[:MAX_PREFIX], ()):
+            scores[product_id] = 1.0
+        for product_id in self._exact.get(token, ()):
+            scores[product_id] = 1.5
+        if scores or len(token) < 3:
+            return scores
+
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            for word in self._trigrams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        for word, count in shared.items():
+            similarity = count / (len(grams) + self._trigram_counts[word] - count)
+            if similarity >= FUZZY_THRESHOLD:
+                for product_id in self._exact[word]:
+                    scores[product_id] = max(scores.get(product_id, 0), similarity)
+        return scores
+
+    def search(self, query, offset=0, limit=50):
+        """Entries matching every word of query, best first"""
+        # A single letter would match most of the catalog; wait for the next one
+        tokens = [token for token in tokenize(query) if len(token) >= MIN_PREFIX]
+        if not tokens:
+            ids = self.newest
+        else:
+            scores = None
+            for token in tokens:
+                matched = self._match(token)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {pk: score + matched[pk] for pk, score in scores.items() if pk in matched}
+                if not scores:
+                    return []
+            ids = sorted(scores, key=lambda pk: (-scores[pk], -pk))
+        return [self.entries[pk] for pk in ids[offset:offset + limit]]
+
+
+_index = None
+_checked_at = 0.0
+_building = False
+_lock = threading.Lock()
+
+
+def _build(version):
+    started = time.perf_counter()
+    index = InlineIndex.build(version=version)
+    logger.info(
+        f"Inline index rebuilt: {len(index.entries)} products, version {version}, "
+        f"{(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    return index
+
+
+def _rebuild(version):
+    """Build the index for version in the background and swap it in when done"""
+    global _index, _building
+    try:
+        _index = _build(version)
+    except Exception as e:
+        logger.error(f"Could not rebuild the inline index: {str(e)}")
+    finally:
+        _building = False
+        connection.close()
+
+
+def get_inline_index():
+    """Return the process-wide inline index, rebuilding it after a catalog version bump
+
+    Only the first build runs on the calling thread. Later rebuilds run on a
+    background thread while queries keep being answered from the previous index,
+    which is replaced by a single assignment once the new one is complete.
+    """
+    global _index, _checked_at, _building
+
+    index = _index
+    if index is not None and time.monotonic() - _checked_at < getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1):
+        return index
+
+    with _lock:
+        version = get_catalog_version()
+        _checked_at = time.monotonic()
+        if _index is None:
+            _index = _build(version)
+        elif (_index.version != version or version is None) and not _building:
+            _building = True
+            threading.Thread(target=_rebuild, args=(version,), name='inline-index', daemon=True).start()
+        return _index
@@ -0,0 +1,47 @@
+import functools
+import time
+
+from telegram.utils.request import Request
+
+from shop.metrics import REGISTRY, WorkMetrics
+
+from . import user_cache, utils
+
+BOT_UPDATES = WorkMetrics('bot_updates', 'Bot updates', ['handler'])
+
+TELEGRAM_API_DURATION = REGISTRY.histogram(
+    'telegram_api_duration_seconds', 'Latency of Telegram Bot API calls', ['method']
+)
+TELEGRAM_API_ERRORS = REGISTRY.counter('telegram_api_errors_total', 'Failed Telegram Bot API calls', ['method'])
+
+REGISTRY.register_cache('bot_user', user_cache._local)
+REGISTRY.register_cache('keyboards', utils._keyboards)
+
+
+def instrument_handler(callback):
+    """Record BOT_UPDATES for a dispatcher callback under its function name"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        with BOT_UPDATES.track(handler=name):
+            return callback(update, context)
+
+    return wrapper
+
+
+class InstrumentedRequest(Request):
+    """Telegram transport that records the latency of every API call"""
+
+    __slots__ = ()
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            return super().post(url, data, timeout=timeout)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(method=method)
+            raise
+        finally:
+            TELEGRAM_API_DURATION.observe(time.perf_counter() - started, method=method)
@@ -0,0 +1,305 @@
+import functools
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+from queue import Queue
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from telegram.ext import Dispatcher
+
+from bot.handlers import setup_handlers
+from bot.testing import UpdateFactory, make_bot
+from bot.user_cache import _local as user_cache
+from bot.utils import _keyboards as keyboard_cache, get_text
+from shop.catalog import get_category_tree
+from shop.models import Order, ProductColor
+
+User = get_user_model()
+
+BENCH_TELEGRAM_ID = 9_500_000_000
+
+METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'queries', 'api_calls', 'alloc_kb']
+# Timings vary between identical runs; the other metrics are deterministic
+LATENCY_METRICS = {'p50_ms', 'p95_ms', 'p99_ms'}
+# A latency increase below this many ms is not a regression whatever its percentage
+LATENCY_FLOOR_MS = 1.0
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+class Probe:
+    """Stands in for the handler executor and measures every callback it wraps"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.samples = {}
+        self.recording = False
+        self.trace_allocations = False
+
+    def wrap(self, callback):
+        @functools.wraps(callback)
+        def wrapper(update, context):
+            if not self.recording:
+                return callback(update, context)
+
+            queries = [0]
+
+            def count_query(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            hits = user_cache.hits + keyboard_cache.hits
+            misses = user_cache.misses + keyboard_cache.misses
+            api_calls = self.bot.request.count()
+            if self.trace_allocations:
+                tracemalloc.reset_peak()
+                allocated = tracemalloc.get_traced_memory()[0]
+
+            error = 0
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(count_query):
+                    callback(update, context)
+            except Exception:
+                error = 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                sample = self.samples.setdefault(callback.__name__, {
+                    'latency': [], 'queries': 0, 'cache_hits': 0, 'cache_misses': 0,
+                    'api_calls': 0, 'alloc': [], 'errors': 0,
+                })
+                if self.trace_allocations:
+                    sample['alloc'].append(tracemalloc.get_traced_memory()[1] - allocated)
+                else:
+                    sample['latency'].append(elapsed)
+                    sample['queries'] += queries[0]
+                    sample['cache_hits'] += user_cache.hits + keyboard_cache.hits - hits
+                    sample['cache_misses'] += user_cache.misses + keyboard_cache.misses - misses
+                    sample['api_calls'] += self.bot.request.count() - api_calls
+                    sample['errors'] += error
+
+        return wrapper
+
+    def results(self):
+        handlers = {}
+        for name, sample in sorted(self.samples.items()):
+            latency = sorted(sample['latency'])
+            count = len(latency) or 1
+            handlers[name] = {
+                'count': len(latency),
+                'p50_ms': round(percentile(latency, 50) * 1000, 3),
+                'p95_ms': round(percentile(latency, 95) * 1000, 3),
+                'p99_ms': round(percentile(latency, 99) * 1000, 3),
+                'mean_ms': round(sum(latency) / count * 1000, 3),
+                'queries': round(sample['queries'] / count, 2),
+                'cache_hits': round(sample['cache_hits'] / count, 2),
+                'cache_misses': round(sample['cache_misses'] / count, 2),
+                'api_calls': round(sample['api_calls'] / count, 2),
+                'alloc_kb': round(sum(sample['alloc']) / len(sample['alloc']) / 1024, 1) if sample['alloc'] else None,
+                'errors': sample['errors'],
+            }
+        return handlers
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive scripted user journeys (start, contact, browse, color, cart, order, orders, cancel, search) '
+        'through the real handlers against a fake Telegram API and report per-handler latency percentiles, '
+        'queries, cache hits and allocations'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journeys', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10, help='Journeys run before measuring')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--no-allocations', action='store_true', help='Skip the tracemalloc pass')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON from an earlier --output run')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='Percent increase of queries, API calls or allocations over the baseline that fails --compare'
+        )
+        parser.add_argument(
+            '--latency-threshold', type=float, default=50.0,
+            help=f'Percent increase of a latency percentile that fails --compare, if also over {LATENCY_FLOOR_MS:g} ms'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic users and their orders')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        targets = self.pick_targets(rng, options['journeys'] + options['warmup'])
+
+        bot = make_bot()
+        factory = UpdateFactory(bot)
+        dispatcher = Dispatcher(bot, Queue(), workers=1, use_context=True)
+        probe = Probe(bot)
+        setup_handlers(dispatcher, executor=probe)
+        dispatcher.add_error_handler(self.log_error)
+
+        self.cleanup()
+        try:
+            journeys = [(BENCH_TELEGRAM_ID + i, target) for i, target in enumerate(targets)]
+            warmup, measured = journeys[:options['warmup']], journeys[options['warmup']:]
+
+            for telegram_id, target in warmup:
+                self.run_journey(dispatcher, factory, telegram_id, target)
+
+            probe.recording = True
+            started = time.perf_counter()
+            for telegram_id, target in measured:
+                self.run_journey(dispatcher, factory, telegram_id, target)
+            elapsed = time.perf_counter() - started
+
+            if not options['no_allocations']:
+                # A separate pass: tracing allocations slows every handler down
+                self.cleanup()
+                probe.trace_allocations = True
+                tracemalloc.start()
+                for telegram_id, target in measured:
+                    self.run_journey(dispatcher, factory, telegram_id, target)
+                tracemalloc.stop()
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+        results = {
+            'meta': {
+                'journeys': len(measured),
+                'seed': options['seed'],
+                'elapsed_s': round(elapsed, 3),
+                'commit': self.git_commit(),
+                'database': connection.vendor,
+                'created_at': timezone.now().isoformat(),
+            },
+            'handlers': probe.results(),
+        }
+        self.report(results['handlers'])
+        self.stdout.write(f"{len(measured)} journeys in {elapsed:.2f}s")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.compare(baseline['handlers'], results['handlers'], options['threshold'], options['latency_threshold'])
+
+    def log_error(self, update, context):
+        self.stderr.write(f"Handler error: {context.error!r}")
+
+    @staticmethod
+    def pick_targets(rng, count):
+        """(category path, product id, color id) of orderable products reachable in the menu"""
+        tree = get_category_tree()
+        colors = list(
+            ProductColor.objects.filter(is_available=True, product__is_active=True, product__categories__is_active=True)
+            .values_list('id', 'product_id', 'product__categories__id')
+            .order_by('id')[:5000]
+        )
+        targets = []
+        for color_id, product_id, category_id in colors:
+            node = tree.nodes.get(category_id)
+            if node is None or not node.is_leaf or not tree.is_reachable(node):
+                continue
+            path = []
+            while node is not None:
+                path.append(node.id)
+                node = tree.nodes.get(node.parent_id)
+            targets.append((path[::-1], product_id, color_id))
+        if not targets:
+            raise CommandError('No orderable products in leaf categories; run generate_data first')
+        return [rng.choice(targets) for _ in range(count)]
+
+    @staticmethod
+    def run_journey(dispatcher, factory, telegram_id, target):
+        category_path, product_id, color_id = target
+        language = 'uz'
+
+        def send(update):
+            dispatcher.process_update(update)
+
+        send(factory.message(telegram_id, '/start'))
+        send(factory.contact(telegram_id, '+998901234567'))
+        send(factory.message(telegram_id, get_text('categories', language)))
+        for category_id in category_path:
+            send(factory.callback(telegram_id, f'cat_{category_id}'))
+        send(factory.callback(telegram_id, f'prod_{product_id}'))
+        send(factory.callback(telegram_id, f'color_{color_id}'))
+        send(factory.message(telegram_id, get_text('cart', language)))
+        send(factory.callback(telegram_id, 'view_cart'))
+        send(factory.callback(telegram_id, 'place_order'))
+        send(factory.message(telegram_id, get_text('orders', language)))
+        order_id = Order.objects.filter(user__telegram_id=telegram_id).values_list('id', flat=True).last()
+        if order_id:
+            send(factory.callback(telegram_id, f'cancel_order_{order_id}'))
+        send(factory.message(telegram_id, 'telefon'))
+        send(factory.inline_query(telegram_id, 'tel'))
+        send(factory.callback(telegram_id, 'back_to_categories'))
+
+    @staticmethod
+    def cleanup():
+        User.objects.filter(telegram_id__gte=BENCH_TELEGRAM_ID, telegram_id__lt=BENCH_TELEGRAM_ID + 10 ** 8).delete()
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+            ).strip()
+        except Exception:
+            return None
+
+    def report(self, handlers):
+        header = f"{'handler':32} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'hits':>6} {'misses':>6} {'api':>5} {'alloc KB':>9} {'errors':>6}"
+        self.stdout.write(header)
+        for name, row in handlers.items():
+            self.stdout.write(
+                f"{name:32} {row['count']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                f"{row['queries']:>8.2f} {row['cache_hits']:>6.2f} {row['cache_misses']:>6.2f} "
+                f"{row['api_calls']:>5.2f} {'-' if row['alloc_kb'] is None else row['alloc_kb']:>9} {row['errors']:>6}"
+            )
+
+    def compare(self, baseline, current, threshold, latency_threshold):
+        regressions = 0
+        self.stdout.write(self.style.MIGRATE_HEADING('Change against baseline'))
+        for name, row in current.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f"{name:32} new")
+                continue
+            changes = []
+            for metric in METRICS:
+                old, new = before.get(metric), row[metric]
+                if old is None or new is None:
+                    continue
+                change = (new - old) / old * 100 if old else (100.0 if new else 0.0)
+                text = f"{metric} {old}->{new} ({change:+.0f}%)"
+                if metric in LATENCY_METRICS:
+                    regressed = change > latency_threshold and new - old >= LATENCY_FLOOR_MS
+                else:
+                    regressed = change > threshold
+                if regressed:
+                    regressions += 1
+                    text = self.style.ERROR(text)
+                changes.append(text)
+            self.stdout.write(f"{name:32} " + ', '.join(changes))
+
+        if regressions:
+            raise CommandError(
+                f'{regressions} metrics regressed: queries, API calls or allocations by more than {threshold:.0f}%, '
+                f'or latencies by more than {latency_threshold:.0f}% and {LATENCY_FLOOR_MS:g} ms'
+            )
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from queue import Queue
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from telegram.ext import Dispatcher
+
+from bot.concurrency import PerUserExecutor
+from bot.handlers import setup_handlers
+from bot.testing import UpdateFactory, make_bot
+from bot.utils import get_text
+from shop.catalog import get_category_tree
+from shop.models import Product, ProductColor
+
+User = get_user_model()
+
+LOADTEST_TELEGRAM_ID = 9_000_000_000
+
+
+class Command(BaseCommand):
+    help = 'Replay synthetic updates through the bot handlers against a fake Telegram API and report updates/sec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=settings.BOT_WORKERS)
+        parser.add_argument('--sequential', action='store_true', help='Handle updates on the dispatcher thread')
+        parser.add_argument(
+            '--api-latency', type=float, default=0.005,
+            help='Seconds the fake Telegram API takes to answer each call'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic users afterwards')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        telegram_ids = self.prepare_users(options['users'])
+
+        tree = get_category_tree()
+        category_ids = list(tree.nodes)
+        product_ids = list(Product.objects.filter(is_active=True).values_list('id', flat=True)[:500])
+        color_ids = list(ProductColor.objects.filter(is_available=True).values_list('id', flat=True)[:500])
+
+        bot = make_bot(latency=options['api_latency'])
+        factory = UpdateFactory(bot)
+        updates = [
+            self.make_update(factory, rng, rng.choice(telegram_ids), category_ids, product_ids, color_ids)
+            for _ in range(options['updates'])
+        ]
+
+        dispatcher = Dispatcher(bot, Queue(), workers=options['workers'], use_context=True)
+        executor = None if options['sequential'] else PerUserExecutor()
+        setup_handlers(dispatcher, executor=executor)
+
+        ready = threading.Event()
+        thread = threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, daemon=True)
+        thread.start()
+        ready.wait()
+
+        started = time.perf_counter()
+        for update in updates:
+            dispatcher.process_update(update)
+        if executor is not None:
+            executor.wait_idle()
+        elapsed = time.perf_counter() - started
+
+        dispatcher.stop()
+
+        mode = 'sequential' if executor is None else f"{options['workers']} workers"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(updates)} updates from {len(telegram_ids)} users in {elapsed:.2f}s "
+                f"({len(updates) / elapsed:.1f} updates/sec, {mode}, "
+                f"{bot.request.count()} API calls)"
+            )
+        )
+
+        if options['cleanup']:
+            User.objects.filter(telegram_id__in=telegram_ids).delete()
+
+    def prepare_users(self, count):
+        telegram_ids = [LOADTEST_TELEGRAM_ID + i for i in range(count)]
+        existing = set(User.objects.filter(telegram_id__in=telegram_ids).values_list('telegram_id', flat=True))
+        User.objects.bulk_create([
+            User(
+                username=f'loadtest_{telegram_id}',
+                telegram_id=telegram_id,
+                phone_number='+998900000000',
+                password='!'
+            )
+            for telegram_id in telegram_ids if telegram_id not in existing
+        ])
+        return telegram_ids
+
+    @staticmethod
+    def make_update(factory, rng, telegram_id, category_ids, product_ids, color_ids):
+        roll = rng.random()
+        if roll < 0.15:
+            return factory.message(telegram_id, get_text('categories', 'uz'))
+        if roll < 0.45 and category_ids:
+            return factory.callback(telegram_id, f'cat_{rng.choice(category_ids)}')
+        if roll < 0.65 and product_ids:
+            return factory.callback(telegram_id, f'prod_{rng.choice(product_ids)}')
+        if roll < 0.75 and color_ids:
+            return factory.callback(telegram_id, f'color_{rng.choice(color_ids)}')
+        if roll < 0.85:
+            return factory.callback(telegram_id, 'view_cart')
+        if roll < 0.95:
+            return factory.callback(telegram_id, 'back_to_categories')
+        return factory.message(telegram_id, get_text('cart', 'uz'))
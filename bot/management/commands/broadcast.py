@@ -0,0 +1,127 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from bot.broadcast import deactivate, init_worker, iter_recipient_chunks, make_sender, send_chunk
+from shop.models import Broadcast
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Send a broadcast to every user with is_active_bot set, from several processes sharing '
+        'the Telegram rate limit; an interrupted run resumes where it stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('broadcast_id', type=int)
+        parser.add_argument('--processes', type=int, default=4, help='Sending processes')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Recipients handed to a process at a time')
+        parser.add_argument('--restart', action='store_true', help='Send to everyone again, even if the broadcast is done')
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise CommandError('TELEGRAM_BOT_TOKEN is not set in settings')
+
+        try:
+            broadcast = Broadcast.objects.get(pk=options['broadcast_id'])
+        except Broadcast.DoesNotExist:
+            raise CommandError(f"Broadcast {options['broadcast_id']} does not exist")
+
+        if options['restart']:
+            Broadcast.objects.filter(pk=broadcast.pk).update(
+                last_user_id=0, sent_count=0, failed_count=0, blocked_count=0, finished_at=None
+            )
+            broadcast.refresh_from_db()
+        elif broadcast.status == 'done':
+            raise CommandError(f'Broadcast {broadcast.id} is done; pass --restart to send it again')
+
+        Broadcast.objects.filter(pk=broadcast.pk).update(
+            status='running', error='', started_at=broadcast.started_at or timezone.now()
+        )
+        if broadcast.last_user_id:
+            self.stdout.write(f'Resuming after user {broadcast.last_user_id}')
+
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+        self.broadcast = broadcast
+        self.started = time.perf_counter()
+        self.sent = 0
+
+        if broadcast.image and not broadcast.image_file_id:
+            # Upload the image once here; the workers send its file_id
+            sender = make_sender(broadcast)
+            try:
+                for chunk in iter_recipient_chunks(broadcast.last_user_id, chunk_size=20):
+                    result = sender.upload_image(chunk)
+                    self.record(result)
+                    if broadcast.image_file_id:
+                        break
+            except Exception as e:
+                # An image Telegram rejects fails for every recipient: stop rather than leave it running
+                Broadcast.objects.filter(pk=broadcast.pk).update(status='failed', error=str(e))
+                raise CommandError(f'Broadcast {broadcast.id} failed, the image could not be sent: {str(e)}')
+
+        # Children must open their own database connections
+        connections.close_all()
+
+        processes = max(1, options['processes'])
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes, initializer=init_worker, initargs=(broadcast.id,)) as pool:
+            # Chunks complete in order, so the watermark only passes recipients that were handled.
+            # A few chunks per process stay queued; the rest are still in the database cursor.
+            pending = deque()
+            for chunk in iter_recipient_chunks(broadcast.last_user_id, options['chunk_size']):
+                if stopping.is_set():
+                    break
+                pending.append(pool.apply_async(send_chunk, (chunk,)))
+                if len(pending) >= processes * 2:
+                    self.record(pending.popleft().get())
+            while pending:
+                self.record(pending.popleft().get())
+
+        if stopping.is_set():
+            Broadcast.objects.filter(pk=broadcast.pk).update(status='paused')
+            self.stdout.write(self.style.WARNING(
+                f'Broadcast {broadcast.id} paused after user {broadcast.last_user_id}; run again to resume'
+            ))
+            return
+
+        Broadcast.objects.filter(pk=broadcast.pk).update(status='done', finished_at=timezone.now())
+        broadcast.refresh_from_db()
+        self.stdout.write(self.style.SUCCESS(
+            f'Broadcast {broadcast.id} done: {broadcast.sent_count} sent, {broadcast.failed_count} failed, '
+            f'{broadcast.blocked_count} blocked the bot'
+        ))
+
+    def record(self, result):
+        """Move the resume watermark past a handled chunk and add up its counts"""
+        if result.last_user_id is None:
+            return
+        deactivate(result.blocked)
+        Broadcast.objects.filter(pk=self.broadcast.pk).update(
+            last_user_id=result.last_user_id,
+            sent_count=F('sent_count') + result.sent,
+            failed_count=F('failed_count') + result.failed,
+            blocked_count=F('blocked_count') + len(result.blocked),
+        )
+        self.broadcast.last_user_id = result.last_user_id
+        self.sent += result.sent
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(f'{self.sent} sent ({self.sent / elapsed:.1f}/s), up to user {result.last_user_id}', ending='\r')
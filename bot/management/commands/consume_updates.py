@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import signal
+import threading
+from queue import Queue
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+
+from bot.concurrency import PerUserExecutor
+from bot.handlers import setup_handlers
+from bot.instrumentation import InstrumentedRequest
+from bot.persistence import RedisPersistence
+from bot.update_queue import dequeue_update, queue_keys
+from shop.metrics import start_metrics_server
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def consume(keys, workers, sequential, metrics_port=None, persistent=True, metrics_address='127.0.0.1'):
+    """Consumer process: pop updates from the given shards and dispatch them"""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_address)
+
+    bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=InstrumentedRequest(con_pool_size=workers + 4))
+    persistence = RedisPersistence() if persistent else None
+    dispatcher = Dispatcher(bot, Queue(), workers=workers, use_context=True, persistence=persistence)
+    executor = None if sequential else PerUserExecutor()
+    setup_handlers(dispatcher, executor=executor)
+
+    ready = threading.Event()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, daemon=True).start()
+    ready.wait()
+    logger.info(f"Consuming {', '.join(keys)}")
+
+    while not stopping.is_set():
+        try:
+            data = dequeue_update(keys, timeout=1)
+        except Exception as e:
+            logger.error(f"Update queue unavailable: {str(e)}")
+            stopping.wait(1)
+            continue
+        if data is None:
+            continue
+
+        try:
+            dispatcher.process_update(Update.de_json(data, bot))
+        except Exception:
+            logger.exception(f"Failed to process update {data.get('update_id')}")
+
+    if executor is not None:
+        executor.wait_idle(timeout=30)
+    dispatcher.stop()
+    if persistence is not None:
+        persistence.flush()
+
+
+class Command(BaseCommand):
+    help = 'Dispatch webhook updates queued in Redis with a pool of consumer processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.BOT_UPDATE_SHARDS,
+            help='Consumer processes; each owns a fixed subset of the BOT_UPDATE_SHARDS queues'
+        )
+        parser.add_argument('--workers', type=int, default=settings.BOT_WORKERS, help='Worker threads per process')
+        parser.add_argument('--sequential', action='store_true', help='Handle updates on the dispatcher thread')
+        parser.add_argument('--set-webhook', metavar='URL', help='Register URL (ending in /bot/webhook/) with Telegram first')
+        parser.add_argument(
+            '--metrics-port', type=int,
+            help='Serve Prometheus metrics; consumer process i listens on this port + i'
+        )
+        parser.add_argument(
+            '--metrics-address', default='127.0.0.1',
+            help='Address the metrics server listens on; 0.0.0.0 exposes it on every interface'
+        )
+        parser.add_argument(
+            '--no-persistence', action='store_true',
+            help='Keep context.user_data in memory only instead of in Redis'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            self.stdout.write(
+                self.style.ERROR('TELEGRAM_BOT_TOKEN is not set in settings')
+            )
+            return
+
+        if options['set_webhook']:
+            if not settings.TELEGRAM_WEBHOOK_SECRET:
+                self.stdout.write(
+                    self.style.ERROR('TELEGRAM_WEBHOOK_SECRET is not set; the webhook refuses updates without it')
+                )
+                return
+            Bot(settings.TELEGRAM_BOT_TOKEN).set_webhook(
+                options['set_webhook'], api_kwargs={'secret_token': settings.TELEGRAM_WEBHOOK_SECRET}
+            )
+            self.stdout.write(self.style.SUCCESS(f"Webhook set to {options['set_webhook']}"))
+
+        keys = queue_keys()
+        processes = max(1, min(options['processes'], len(keys)))
+        if processes < options['processes']:
+            self.stdout.write(self.style.WARNING(f'Only {len(keys)} shards configured, starting {processes} processes'))
+
+        # Children must open their own database connections
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(
+                target=consume,
+                args=(
+                    keys[i::processes], options['workers'], options['sequential'],
+                    options['metrics_port'] + i if options['metrics_port'] else None,
+                    settings.BOT_PERSISTENCE and not options['no_persistence'],
+                    options['metrics_address']
+                ),
+                name=f'bot-consumer-{i}'
+            )
+            for i in range(processes)
+        ]
+        for child in children:
+            child.start()
+
+        self.stdout.write(self.style.SUCCESS(f'Started {processes} consumer processes'))
+
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+            for child in children:
+                child.join()
@@ -1,14 +1,14 @@
 import logging
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from telegram.ext import Updater, CommandHandler, MessageHandler, CallbackQueryHandler, Filters
-from bot.handlers import (
-    start, contact_handler, categories_handler, category_callback,
-    product_callback, color_callback, cart_handler, view_cart_callback,
-    place_order_callback, clear_cart_callback, language_handler,
-    language_callback, back_to_categories_callback
-)
-from bot.utils import get_text
+from telegram import Bot
+from telegram.ext import Updater
+from bot.concurrency import PerUserExecutor
+from bot.handlers import setup_handlers
+from bot.instrumentation import InstrumentedRequest
+from bot.persistence import RedisPersistence
+from bot.utils import set_text_trace
+from shop.metrics import start_metrics_server
 
 # Enable logging
 logging.basicConfig(
@@ -21,49 +21,57 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Run Telegram Bot'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--trace-texts', action='store_true', help='Log every text lookup at DEBUG level')
+        parser.add_argument(
+            '--workers', type=int, default=settings.BOT_WORKERS,
+            help='Worker threads running handlers; each holds one database connection'
+        )
+        parser.add_argument(
+            '--sequential', action='store_true',
+            help='Run every handler on the dispatcher thread, one update at a time'
+        )
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics of the bot on this port')
+        parser.add_argument(
+            '--metrics-address', default='127.0.0.1',
+            help='Address the metrics server listens on; 0.0.0.0 exposes it on every interface'
+        )
+        parser.add_argument(
+            '--no-persistence', action='store_true',
+            help='Keep context.user_data in memory only instead of in Redis'
+        )
+
     def handle(self, *args, **options):
         """Run the bot"""
+        if options['trace_texts']:
+            set_text_trace()
+
         if not settings.TELEGRAM_BOT_TOKEN:
             self.stdout.write(
                 self.style.ERROR('TELEGRAM_BOT_TOKEN is not set in settings')
             )
             return
 
-        # Create updater
-        updater = Updater(settings.TELEGRAM_BOT_TOKEN, use_context=True)
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'], options['metrics_address'])
+
+        # Create updater; the request pool matches what Updater would size for these workers
+        bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=InstrumentedRequest(con_pool_size=options['workers'] + 4))
+        persistence = None
+        if settings.BOT_PERSISTENCE and not options['no_persistence']:
+            persistence = RedisPersistence()
+        updater = Updater(bot=bot, workers=options['workers'], use_context=True, persistence=persistence)
         dispatcher = updater.dispatcher
 
         # Add handlers
-        dispatcher.add_handler(CommandHandler("start", start))
-
-        # Message handlers
-        dispatcher.add_handler(MessageHandler(Filters.contact, contact_handler))
-        dispatcher.add_handler(MessageHandler(
-            Filters.regex(f"^({get_text('categories', 'uz')}|{get_text('categories', 'ru')})$"),
-            categories_handler
-        ))
-        dispatcher.add_handler(MessageHandler(
-            Filters.regex(f"^({get_text('cart', 'uz')}|{get_text('cart', 'ru')})$"),
-            cart_handler
-        ))
-        dispatcher.add_handler(MessageHandler(
-            Filters.regex(f"^({get_text('language', 'uz')}|{get_text('language', 'ru')})$"),
-            language_handler
-        ))
-
-        dispatcher.add_handler(CallbackQueryHandler(category_callback, pattern=r"^cat_\d+$"))
-        dispatcher.add_handler(CallbackQueryHandler(product_callback, pattern=r"^prod_\d+$"))
-        dispatcher.add_handler(CallbackQueryHandler(color_callback, pattern=r"^color_\d+$"))
-        dispatcher.add_handler(CallbackQueryHandler(view_cart_callback, pattern="^view_cart$"))
-        dispatcher.add_handler(CallbackQueryHandler(place_order_callback, pattern="^place_order$"))
-        dispatcher.add_handler(CallbackQueryHandler(clear_cart_callback, pattern="^clear_cart$"))
-        dispatcher.add_handler(CallbackQueryHandler(language_callback, pattern=r"^lang_(uz|ru)$"))
-        dispatcher.add_handler(CallbackQueryHandler(back_to_categories_callback, pattern="^back_to_categories$"))
+        executor = None if options['sequential'] else PerUserExecutor()
+        setup_handlers(dispatcher, executor=executor)
 
+        mode = 'sequential' if executor is None else f"{options['workers']} workers"
         self.stdout.write(
-            self.style.SUCCESS('Bot started successfully!')
+            self.style.SUCCESS(f'Bot started successfully! ({mode})')
         )
 
         # Run the bot
         updater.start_polling()
-        updater.idle()
\ No newline at end of file
+        updater.idle()
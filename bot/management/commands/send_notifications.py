@@ -0,0 +1,145 @@
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, Unauthorized
+
+from bot.instrumentation import InstrumentedRequest
+from bot.notifications import NotificationQueue
+from bot.ratelimit import RateLimiter
+from bot.user_cache import invalidate_user_context
+from bot.utils import format_text, get_text
+from shop.metrics import REGISTRY, start_metrics_server
+from shop.models import Order
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+NOTIFICATIONS = REGISTRY.counter('bot_notifications_total', 'Order status notifications by outcome', ['result'])
+
+
+class Command(BaseCommand):
+    help = 'Send queued order status notifications to customers, within the Telegram rate limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Threads sending messages')
+        parser.add_argument('--batch-size', type=int, default=100, help='Orders claimed from the queue at a time')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+        parser.add_argument(
+            '--metrics-address', default='127.0.0.1',
+            help='Address the metrics server listens on; 0.0.0.0 exposes it on every interface'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            self.stdout.write(
+                self.style.ERROR('TELEGRAM_BOT_TOKEN is not set in settings')
+            )
+            return
+
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'], options['metrics_address'])
+
+        self.bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=InstrumentedRequest(con_pool_size=options['workers'] + 4))
+        self.queue = NotificationQueue()
+        self.limiter = RateLimiter()
+        self.stopping = stopping
+
+        self.stdout.write(self.style.SUCCESS(f"Sending notifications with {options['workers']} workers"))
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='notify') as pool:
+            while not stopping.is_set():
+                # Drop a connection the database closed or broke while the loop waited
+                close_old_connections()
+                try:
+                    order_ids, lease = self.queue.claim(options['batch_size'])
+                except Exception as e:
+                    logger.error(f"Notification queue unavailable: {str(e)}")
+                    stopping.wait(options['poll_interval'])
+                    continue
+                if not order_ids:
+                    stopping.wait(options['poll_interval'])
+                    continue
+
+                try:
+                    orders = Order.objects.select_related('user').only(
+                        'id', 'status', 'notified_status',
+                        'user__id', 'user__telegram_id', 'user__language', 'user__is_active_bot'
+                    ).in_bulk(order_ids)
+                except Exception as e:
+                    # The claimed orders come back once their lease expires
+                    logger.error(f"Could not load orders to notify: {str(e)}")
+                    stopping.wait(options['poll_interval'])
+                    continue
+                # Consume the iterator so the next batch is claimed only once this one is sent
+                list(pool.map(lambda order_id: self.deliver(order_id, orders.get(order_id), lease), order_ids))
+
+    def deliver(self, order_id, order, lease):
+        try:
+            result = self.send(order_id, order, lease)
+        except Exception as e:
+            logger.exception(f"Notification for order {order_id} failed: {str(e)}")
+            result = 'retried' if self.queue.failed(order_id, lease) else 'failed'
+        finally:
+            close_old_connections()
+        NOTIFICATIONS.inc(result=result)
+
+    def send(self, order_id, order, lease):
+        if order is None:
+            self.queue.done(order_id, lease)
+            return 'skipped'
+        user = order.user
+        if order.status == (order.notified_status or 'pending') or not user.telegram_id or not user.is_active_bot:
+            self.queue.done(order_id, lease)
+            return 'skipped'
+
+        # Wait out the bot-wide bucket; a chat that is over its own limit goes back to the queue
+        while True:
+            wait, bucket = self.limiter.try_acquire(user.telegram_id)
+            if bucket != 'global':
+                break
+            time.sleep(wait)
+        if bucket == 'chat':
+            self.queue.retry(order_id, lease, wait)
+            return 'throttled'
+
+        text = format_text(
+            'order_status_changed', user.language,
+            order_id=order.id, status=get_text(f'order_status_{order.status}', user.language)
+        )
+        try:
+            self.bot.send_message(chat_id=user.telegram_id, text=text)
+        except RetryAfter as e:
+            logger.warning(f"Flood limit hit, pausing {e.retry_after}s")
+            self.queue.retry(order_id, lease, e.retry_after)
+            self.stopping.wait(e.retry_after)
+            return 'throttled'
+        except (Unauthorized, BadRequest) as e:
+            if isinstance(e, BadRequest) and 'chat not found' not in e.message.lower():
+                raise
+            # Blocked the bot or deleted the chat: stop sending to this user
+            logger.info(f"Not notifying user {user.id} any more: {str(e)}")
+            User.objects.filter(pk=user.id).update(is_active_bot=False)
+            invalidate_user_context(user.telegram_id)
+            self.queue.done(order_id, lease)
+            return 'unreachable'
+
+        Order.objects.filter(pk=order.id).update(notified_status=order.status)
+        self.queue.done(order_id, lease)
+        return 'sent'
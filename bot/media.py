@@ -0,0 +1,34 @@
+from telegram.error import BadRequest
+from shop.imaging import open_for_telegram
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def reply_photo(message, instance, image_field, file_id_field, variants_field, **kwargs):
+    """Reply with an image stored on instance, uploading it only the first time
+
+    The upload uses the resized Telegram variant when it has been built. The
+    file_id Telegram returns is saved on instance and sent instead of the file
+    afterwards. shop.signals clears it when the image changes.
+    """
+    file_id = getattr(instance, file_id_field)
+    if file_id:
+        try:
+            return message.reply_photo(photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"Cached file_id rejected for {instance._meta.label} {instance.pk}: {str(e)}")
+
+    image = getattr(instance, image_field)
+    upload = open_for_telegram(instance, image_field, variants_field)
+    try:
+        sent = message.reply_photo(photo=upload, **kwargs)
+    finally:
+        upload.close()
+
+    if sent and sent.photo:
+        file_id = sent.photo[-1].file_id
+        setattr(instance, file_id_field, file_id)
+        # Only store it if the image was not replaced in the meantime; update() skips signals
+        type(instance).objects.filter(pk=instance.pk, **{image_field: image.name}).update(**{file_id_field: file_id})
+    return sent
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Order ids waiting to be notified, scored by the time they are due
+QUEUE_KEY = 'bot:notify:orders'
+ATTEMPTS_KEY = 'bot:notify:attempts'
+
+# A claimed order is pushed LEASE seconds into the future, so it comes back if the
+# worker dies before releasing it
+LEASE = 300
+
+# Move up to ARGV[2] orders due by ARGV[1] to the lease time ARGV[3] and return them
+CLAIM = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return due
+"""
+
+# Drop order ARGV[1] (or reschedule it to ARGV[3]) unless a newer status change
+# moved it off the lease ARGV[2] while it was being sent
+RELEASE = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) ~= tonumber(ARGV[2]) then
+    return 0
+end
+if ARGV[3] == '' then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+end
+return 1
+"""
+
+
+def queue_status_notification(order_id, delay=None):
+    """Schedule a notification of order_id's current status
+
+    Changes within BOT_NOTIFY_DELAY of the first one are coalesced: ZADD LT never
+    postpones an order already waiting, and the worker sends whatever status the
+    order has when it is due.
+    """
+    delay = settings.BOT_NOTIFY_DELAY if delay is None else delay
+    try:
+        get_redis_connection('default').zadd(QUEUE_KEY, {order_id: time.time() + delay}, lt=True)
+    except Exception as e:
+        logger.error(f"Could not queue status notification for order {order_id}: {str(e)}")
+
+
+class NotificationQueue:
+    """Worker side of the queue: claim due orders, then release or reschedule each one"""
+
+    def __init__(self, alias='default'):
+        self.redis = get_redis_connection(alias)
+        self._claim = self.redis.register_script(CLAIM)
+        self._release = self.redis.register_script(RELEASE)
+
+    def claim(self, limit):
+        """Ids of up to limit due orders and the lease they were claimed under"""
+        now = time.time()
+        lease = f'{now + LEASE:.3f}'
+        return [int(order_id) for order_id in self._claim(keys=[QUEUE_KEY], args=[now, limit, lease])], lease
+
+    def done(self, order_id, lease):
+        self._release(keys=[QUEUE_KEY], args=[order_id, lease, ''])
+        self.redis.hdel(ATTEMPTS_KEY, order_id)
+
+    def retry(self, order_id, lease, delay):
+        self._release(keys=[QUEUE_KEY], args=[order_id, lease, f'{time.time() + delay:.3f}'])
+
+    def failed(self, order_id, lease):
+        """Reschedule with exponential backoff; False once BOT_NOTIFY_MAX_ATTEMPTS is reached"""
+        attempts = self.redis.hincrby(ATTEMPTS_KEY, order_id, 1)
+        if attempts >= settings.BOT_NOTIFY_MAX_ATTEMPTS:
+            self.done(order_id, lease)
+            return False
+        self.retry(order_id, lease, min(settings.BOT_NOTIFY_BACKOFF * 2 ** (attempts - 1), 3600))
+        return True
+
+    def pending(self):
+        return self.redis.zcard(QUEUE_KEY)
@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from telegram.ext import BasePersistence
+import logging
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = 'bot:state:user:{user_id}'
+CONVERSATIONS_KEY = 'bot:state:conversations:{name}'
+
+FLUSH_BATCH_SIZE = 500
+
+# Seconds between sweeps of users not seen for BOT_PERSISTENCE_TTL
+PRUNE_INTERVAL = 60
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class RedisPersistence(BasePersistence):
+    """user_data and ConversationHandler states kept in Redis, one key per user
+
+    user_data of a user is read from Redis the first time one of their updates
+    reaches this process, so the dispatcher starts empty and warms up as users
+    come back. Changes are written behind: handlers only mark a user dirty and a
+    background thread writes all dirty users in one pipeline every
+    BOT_PERSISTENCE_FLUSH_INTERVAL seconds, so at most that much state is lost
+    if the process is killed. Values are stored as compact JSON (dict keys come
+    back as strings) and expire after BOT_PERSISTENCE_TTL seconds of inactivity.
+
+    Every update of a user is dispatched by the same process (consume_updates
+    shards by user), so the local copy is authoritative once loaded.
+    """
+
+    def __init__(self, ttl=None, flush_interval=None, alias='default'):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.ttl = ttl or settings.BOT_PERSISTENCE_TTL
+        self.flush_interval = flush_interval or settings.BOT_PERSISTENCE_FLUSH_INTERVAL
+        self.alias = alias
+
+        # The dispatcher's user_data
+        self._user_data = defaultdict(dict)
+        # user_id -> time of their last update; users not seen for the TTL are
+        # forgotten, like their Redis key, and loaded again if they come back
+        self._loaded = {}
+        # user_id -> (payload, time written); a user whose payload did not change is
+        # rewritten only once half of the TTL has passed, to keep the key alive
+        self._written = {}
+        self._pruned_at = time.monotonic()
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bot-persistence', daemon=True)
+        self._thread.start()
+
+    @property
+    def redis(self):
+        return get_redis_connection(self.alias)
+
+    # user_data
+
+    def insert_bot(self, obj):
+        # Stored values are plain JSON with no Bot in them; returning obj itself rather
+        # than a copy keeps the dispatcher's user_data the dict _prune clears
+        return obj
+
+    def get_user_data(self):
+        return self._user_data
+
+    def refresh_user_data(self, user_id, user_data):
+        with self._lock:
+            # Put back the dict this update works on if _prune dropped it meanwhile
+            if self._user_data.get(user_id) is not user_data:
+                self._user_data[user_id] = user_data
+            if user_id in self._loaded:
+                self._loaded[user_id] = time.monotonic()
+                return
+        try:
+            payload = self.redis.get(USER_KEY.format(user_id=user_id))
+        except Exception as e:
+            logger.warning(f"Bot state unavailable for user {user_id}: {str(e)}")
+            return
+        self._loaded[user_id] = time.monotonic()
+        if payload is None:
+            return
+        stored = json.loads(payload)
+        # Anything set locally while Redis was unreachable is newer than the stored copy
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+        self._written[user_id] = (dumps(stored), time.monotonic())
+
+    def update_user_data(self, user_id, data):
+        try:
+            payload = dumps(data)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"user_data of user {user_id} is not JSON serializable, not saved: {str(e)}")
+            return
+
+        written = self._written.get(user_id)
+        if written is not None and written[0] == payload and time.monotonic() - written[1] < self.ttl / 2:
+            return
+        if written is None and payload == '{}':
+            return
+
+        with self._lock:
+            self._dirty_users[user_id] = payload
+            if len(self._dirty_users) >= FLUSH_BATCH_SIZE:
+                self._wake.set()
+
+    # ConversationHandler states
+
+    def get_conversations(self, name):
+        try:
+            stored = self.redis.hgetall(CONVERSATIONS_KEY.format(name=name))
+        except Exception as e:
+            logger.warning(f"Conversation states of {name} unavailable: {str(e)}")
+            return {}
+        return {tuple(json.loads(key)): json.loads(state) for key, state in stored.items()}
+
+    def update_conversation(self, name, key, new_state):
+        try:
+            payload = None if new_state is None else dumps(new_state)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"State of conversation {name} is not JSON serializable, not saved: {str(e)}")
+            return
+        with self._lock:
+            self._dirty_conversations[(name, dumps(list(key)))] = payload
+
+    # chat_data, bot_data and callback_data are not used by this bot
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    def get_bot_data(self):
+        return {}
+
+    def update_bot_data(self, data):
+        pass
+
+    def refresh_bot_data(self, bot_data):
+        pass
+
+    def get_callback_data(self):
+        return None
+
+    def update_callback_data(self, data):
+        pass
+
+    # write-behind
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write()
+
+    def _prune(self):
+        """Forget users whose last update is older than the TTL, user_data included"""
+        now = time.monotonic()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        expired = [user_id for user_id, seen in list(self._loaded.items()) if now - seen > self.ttl]
+        if not expired:
+            return
+        forgotten = 0
+        with self._lock:
+            for user_id in expired:
+                # Skip a user whose update arrived since the scan
+                if now - self._loaded.get(user_id, now) <= self.ttl:
+                    continue
+                del self._loaded[user_id]
+                self._written.pop(user_id, None)
+                self._user_data.pop(user_id, None)
+                forgotten += 1
+        logger.debug(f"Forgot the bot state of {forgotten} inactive users")
+
+    def _write(self):
+        with self._flush_lock:
+            self._prune()
+            with self._lock:
+                users, self._dirty_users = self._dirty_users, {}
+                conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not users and not conversations:
+                return
+
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for user_id, payload in users.items():
+                    if payload == '{}':
+                        pipe.delete(USER_KEY.format(user_id=user_id))
+                    else:
+                        pipe.set(USER_KEY.format(user_id=user_id), payload, ex=self.ttl)
+                for (name, key), payload in conversations.items():
+                    if payload is None:
+                        pipe.hdel(CONVERSATIONS_KEY.format(name=name), key)
+                    else:
+                        pipe.hset(CONVERSATIONS_KEY.format(name=name), key, payload)
+                for name in {name for name, _ in conversations}:
+                    pipe.expire(CONVERSATIONS_KEY.format(name=name), self.ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to save bot state of {len(users)} users: {str(e)}")
+                # Retry on the next flush unless a newer value was queued meanwhile
+                with self._lock:
+                    self._dirty_users = {**users, **self._dirty_users}
+                    self._dirty_conversations = {**conversations, **self._dirty_conversations}
+                return
+
+            now = time.monotonic()
+            for user_id, payload in users.items():
+                self._written[user_id] = (payload, now)
+
+    def flush(self):
+        """Write pending changes now; called by Updater on shutdown"""
+        self._stopping.set()
+        self._wake.set()
+        self._write()
@@ -0,0 +1,81 @@
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+GLOBAL_KEY = 'bot:ratelimit:global'
+CHAT_KEY = 'bot:ratelimit:chat:{chat_id}'
+
+# Token buckets in KEYS, ARGV = now, then rate and capacity per key. Takes a token
+# from every bucket or from none; returns {seconds to wait, index of the limiting key}.
+ACQUIRE = """
+local now = tonumber(ARGV[1])
+local wait, limiting = 0, 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+    available = math.min(capacity, available + elapsed * rate)
+    if available < 1 and (1 - available) / rate > wait then
+        wait, limiting = (1 - available) / rate, i
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return {tostring(wait), limiting}
+end
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {'0', 0}
+"""
+
+
+class RateLimiter:
+    """Token buckets in Redis shared by every process sending through the bot
+
+    One bucket caps the bot as a whole (Telegram allows about 30 messages per
+    second), another each chat (about one message per second); a message takes
+    a token from both or from neither.
+    """
+
+    def __init__(self, rate=None, chat_rate=None, burst=None, chat_burst=1, alias='default'):
+        self.rate = rate or settings.BOT_SEND_RATE
+        self.chat_rate = chat_rate or settings.BOT_SEND_CHAT_RATE
+        self.burst = burst or self.rate
+        self.chat_burst = chat_burst
+        self.redis = get_redis_connection(alias)
+        self._acquire = self.redis.register_script(ACQUIRE)
+
+    def try_acquire(self, chat_id=None):
+        """Take a token for a message to chat_id
+
+        Returns (0.0, None) when the message may be sent now, otherwise the seconds
+        to wait and which bucket is empty: 'global' or 'chat'.
+        """
+        keys = [GLOBAL_KEY]
+        args = [time.time(), self.rate, self.burst]
+        if chat_id is not None:
+            keys.append(CHAT_KEY.format(chat_id=chat_id))
+            args += [self.chat_rate, self.chat_burst]
+
+        wait, limiting = self._acquire(keys=keys, args=args)
+        wait = float(wait)
+        if not wait:
+            return 0.0, None
+        return wait, 'global' if limiting == 1 else 'chat'
+
+    def acquire(self, chat_id=None, timeout=None):
+        """Block until a message to chat_id may be sent; False if that takes longer than timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait, _ = self.try_acquire(chat_id)
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
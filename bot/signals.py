@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from shop.models import Order
+
+from .notifications import queue_status_notification
+from .user_cache import invalidate_user_context
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # After commit, so a concurrent cache miss cannot re-cache the old row
+    telegram_id = instance.telegram_id
+    transaction.on_commit(lambda: invalidate_user_context(telegram_id))
+
+
+@receiver(post_save, sender=Order)
+def order_status_changed(sender, instance, created, **kwargs):
+    """Tell the customer about a status change once the transaction commits"""
+    previous = instance.__dict__.get('_loaded_status')
+    if created or previous is None or previous == instance.status:
+        return
+    if instance.status == (instance.notified_status or 'pending'):
+        return
+    order_id = instance.pk
+    transaction.on_commit(lambda: queue_status_notification(order_id))
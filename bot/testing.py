@@ -0,0 +1,122 @@
+import itertools
+import threading
+import time
+
+from telegram import Bot, Update
+from telegram.utils.request import Request
+
+FAKE_TOKEN = '123456:FAKE-TOKEN-FOR-LOCAL-RUNS'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Shop', 'username': 'shop_bot'}
+
+
+class FakeRequest(Request):
+    """Telegram transport that answers every API call locally and records it"""
+
+    __slots__ = ('latency', 'calls', '_message_ids', '_file_ids', '_lock')
+
+    def __init__(self, latency=0.0):
+        super().__init__(con_pool_size=1)
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((method, data))
+        return self.respond(method, data)
+
+    def respond(self, method, data):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText', 'sendPhoto', 'editMessageCaption'):
+            message = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': data.get('chat_id') or 0, 'type': 'private'},
+                'from': BOT_USER,
+            }
+            if method == 'sendPhoto':
+                file_id = f'fake-photo-{next(self._file_ids)}'
+                message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 1280}]
+            return message
+        return True
+
+    def stop(self):
+        pass
+
+    def count(self, method=None):
+        with self._lock:
+            if method is None:
+                return len(self.calls)
+            return sum(1 for name, data in self.calls if name == method)
+
+
+def make_bot(latency=0.0):
+    return Bot(FAKE_TOKEN, request=FakeRequest(latency=latency))
+
+
+class UpdateFactory:
+    """Builds Telegram updates for a private chat with a given user"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+
+    @staticmethod
+    def user(telegram_id, first_name='Test'):
+        return {'id': telegram_id, 'is_bot': False, 'first_name': first_name, 'language_code': 'uz'}
+
+    def _message(self, telegram_id, **fields):
+        message = {
+            'message_id': next(self._update_ids),
+            'date': int(time.time()),
+            'chat': {'id': telegram_id, 'type': 'private'},
+            'from': self.user(telegram_id),
+        }
+        message.update(fields)
+        return message
+
+    def message(self, telegram_id, text):
+        data = {'update_id': next(self._update_ids), 'message': self._message(telegram_id, text=text)}
+        if text.startswith('/'):
+            data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json(data, self.bot)
+
+    def contact(self, telegram_id, phone_number):
+        contact = {'phone_number': phone_number, 'first_name': 'Test', 'user_id': telegram_id}
+        data = {'update_id': next(self._update_ids), 'message': self._message(telegram_id, contact=contact)}
+        return Update.de_json(data, self.bot)
+
+    def callback(self, telegram_id, callback_data):
+        update_id = next(self._update_ids)
+        message = self._message(telegram_id, text='...')
+        message['from'] = BOT_USER
+        data = {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self.user(telegram_id),
+                'chat_instance': str(telegram_id),
+                'data': callback_data,
+                'message': message,
+            },
+        }
+        return Update.de_json(data, self.bot)
+
+    def inline_query(self, telegram_id, text, offset=''):
+        update_id = next(self._update_ids)
+        data = {
+            'update_id': update_id,
+            'inline_query': {
+                'id': str(update_id),
+                'from': self.user(telegram_id),
+                'query': text,
+                'offset': offset,
+            },
+        }
+        return Update.de_json(data, self.bot)
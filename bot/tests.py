@@ -0,0 +1,189 @@
+import io
+from decimal import Decimal
+from queue import Queue
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+from telegram.error import BadRequest
+from telegram.ext import Dispatcher
+
+from shop import catalog
+from shop.models import Broadcast, Cart, Category, Order, Product, ProductColor, ProductColorImage
+
+from . import inline_index, persistence, user_cache, utils
+from .handlers import setup_handlers
+from .testing import UpdateFactory, make_bot
+from .utils import get_text
+
+User = get_user_model()
+
+TELEGRAM_ID = 700000001
+
+
+class HandlerQueryCountTests(TestCase):
+    """Bot handlers run a fixed number of queries, whatever the catalog or cart size
+
+    Counts include the work run on commit (order rollups, cache writes) and assume
+    a warm process, as bench_bot measures it against production-sized data.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name_uz='Kiyim', name_ru='Одежда')
+        cls.leaf = Category.objects.create(name_uz='Ko‘ylak', name_ru='Рубашки', parent=cls.root)
+        cls.products = []
+        cls.colors = []
+        for i in range(5):
+            product = Product.objects.create(
+                name_uz=f"Ko‘ylak {i}", name_ru=f'Рубашка {i}',
+                main_image='products/shirt.jpg', main_image_file_id=f'photo-product-{i}'
+            )
+            product.categories.add(cls.leaf)
+            cls.products.append(product)
+            for j in range(i + 1):
+                color = ProductColor.objects.create(
+                    product=product, name_uz=f'Rang {j}', name_ru=f'Цвет {j}', price=Decimal('10000') * (j + 1)
+                )
+                ProductColorImage.objects.create(
+                    color=color, image='product_colors/shirt.jpg', file_id=f'photo-color-{color.id}'
+                )
+                cls.colors.append(color)
+        cls.user = User.objects.create(
+            username='customer', telegram_id=TELEGRAM_ID, phone_number='+998901234567'
+        )
+
+    def setUp(self):
+        cache.clear()
+        user_cache._local.clear()
+        utils._keyboards.clear()
+        catalog._tree = None
+        inline_index._index = None
+
+        self.bot = make_bot()
+        self.updates = UpdateFactory(self.bot)
+        self.dispatcher = Dispatcher(self.bot, Queue(), workers=1, use_context=True)
+        self.errors = []
+        self.dispatcher.add_error_handler(lambda update, context: self.errors.append(context.error))
+        setup_handlers(self.dispatcher)
+
+        # A warm process: category tree built and the user cached
+        catalog.get_category_tree()
+        user_cache.get_user_context(TELEGRAM_ID)
+
+    def dispatch(self, update, queries):
+        with self.assertNumQueries(queries):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.dispatcher.process_update(update)
+        self.assertEqual(self.errors, [])
+
+    def fill_cart(self, lines):
+        Cart.objects.bulk_create([Cart(user=self.user, product_color=color, quantity=2) for color in self.colors[:lines]])
+
+    def test_start_new_user(self):
+        self.dispatch(self.updates.message(TELEGRAM_ID + 1, '/start'), 7)
+        self.assertTrue(User.objects.filter(telegram_id=TELEGRAM_ID + 1).exists())
+
+    def test_start_returning_user(self):
+        self.dispatch(self.updates.message(TELEGRAM_ID, '/start'), 1)
+
+    def test_browse(self):
+        self.dispatch(self.updates.message(TELEGRAM_ID, get_text('categories', 'uz')), 0)
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'cat_{self.root.id}'), 0)
+        # The product page is one keyset query
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'cat_{self.leaf.id}'), 1)
+
+    def test_product(self):
+        # One color or five, the product card takes the same queries
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'prod_{self.products[0].id}'), 3)
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'prod_{self.products[4].id}'), 3)
+        self.assertEqual(self.bot.request.count('sendPhoto'), 2)
+
+    def test_color(self):
+        color = self.colors[-1]
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'color_{color.id}'), 8)
+        # Adding the same color again updates the line instead of inserting one
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'color_{color.id}'), 5)
+        self.assertEqual(Cart.objects.get(user=self.user, product_color=color).quantity, 2)
+
+    def test_cart(self):
+        self.fill_cart(1)
+        self.dispatch(self.updates.message(TELEGRAM_ID, get_text('cart', 'uz')), 1)
+        self.dispatch(self.updates.callback(TELEGRAM_ID, 'view_cart'), 1)
+
+        Cart.objects.all().delete()
+        self.fill_cart(len(self.colors))
+        self.dispatch(self.updates.message(TELEGRAM_ID, get_text('cart', 'uz')), 1)
+        self.dispatch(self.updates.callback(TELEGRAM_ID, 'view_cart'), 1)
+
+    def test_place_order(self):
+        self.fill_cart(1)
+        self.dispatch(self.updates.callback(TELEGRAM_ID, 'place_order'), 14)
+
+        self.fill_cart(len(self.colors))
+        self.dispatch(self.updates.callback(TELEGRAM_ID, 'place_order'), 14)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_cancel_order(self):
+        self.fill_cart(3)
+        self.dispatcher.process_update(self.updates.callback(TELEGRAM_ID, 'place_order'))
+        order = Order.objects.get(user=self.user)
+
+        self.dispatch(self.updates.callback(TELEGRAM_ID, f'cancel_order_{order.id}'), 9)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_inline_query_bad_offset(self):
+        for offset in ('abc', '-5'):
+            self.dispatcher.process_update(self.updates.inline_query(TELEGRAM_ID, 'ko', offset=offset))
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.bot.request.count('answerInlineQuery'), 2)
+
+
+class RedisPersistenceTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(persistence, 'get_redis_connection')
+        self.redis = patcher.start()()
+        self.addCleanup(patcher.stop)
+        self.redis.get.return_value = None
+        self.persistence = persistence.RedisPersistence(ttl=60, flush_interval=3600)
+        self.addCleanup(self.persistence._stopping.set)
+        self.user_data = self.persistence.get_user_data()
+
+    def test_failed_write_is_retried(self):
+        self.persistence.update_user_data(1, {'step': 'phone'})
+        self.persistence.update_conversation('checkout', (1, 1), 2)
+        self.redis.pipeline.return_value.execute.side_effect = ConnectionError('redis down')
+        self.persistence._write()
+        self.assertEqual(self.persistence._dirty_users, {1: '{"step":"phone"}'})
+        self.assertEqual(self.persistence._dirty_conversations, {('checkout', '[1,1]'): '2'})
+
+    def test_inactive_users_are_forgotten(self):
+        for user_id in (1, 2):
+            self.persistence.refresh_user_data(user_id, self.user_data[user_id])
+            self.user_data[user_id]['step'] = 'phone'
+        self.persistence._loaded[1] -= 120
+        self.persistence._pruned_at -= persistence.PRUNE_INTERVAL
+
+        self.persistence._prune()
+        self.assertEqual(set(self.persistence._loaded), {2})
+        self.assertEqual(set(self.user_data), {2})
+
+
+class BroadcastCommandTests(TestCase):
+    def test_rejected_image_fails_the_broadcast(self):
+        User.objects.create(username='customer', telegram_id=TELEGRAM_ID)
+        broadcast = Broadcast.objects.create(text_uz='Salom', text_ru='Привет', image='broadcasts/sale.jpg')
+
+        with self.settings(TELEGRAM_BOT_TOKEN='123:test'), \
+                mock.patch('bot.management.commands.broadcast.make_sender') as make_sender:
+            make_sender.return_value.upload_image.side_effect = BadRequest('Photo_invalid_dimensions')
+            with self.assertRaises(CommandError):
+                call_command('broadcast', broadcast.id, stdout=io.StringIO())
+
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.status, 'failed')
+        self.assertIn('Photo_invalid_dimensions', broadcast.error)
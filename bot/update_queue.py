@@ -0,0 +1,31 @@
+import json
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+
+def queue_keys():
+    return [f'{settings.BOT_UPDATE_QUEUE}:{shard}' for shard in range(settings.BOT_UPDATE_SHARDS)]
+
+
+def update_shard(data):
+    """Pick the queue shard for an update so one user's updates always land on the same consumer"""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('chat') or {}
+            if 'id' in sender:
+                return sender['id'] % settings.BOT_UPDATE_SHARDS
+    return 0
+
+
+def enqueue_update(data, raw):
+    """Push the raw update body onto its shard's Redis list"""
+    get_redis_connection('default').lpush(queue_keys()[update_shard(data)], raw)
+
+
+def dequeue_update(keys, timeout=5):
+    """Block until an update is available on one of keys; returns the decoded update or None"""
+    item = get_redis_connection('default').brpop(keys, timeout=timeout)
+    if item is None:
+        return None
+    return json.loads(item[1])
@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+import logging
+
+from shop.metrics import CACHE_REQUESTS
+
+from .utils import LRUCache
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+UserContext = namedtuple('UserContext', ['user_id', 'language', 'phone_number', 'is_active_bot'])
+
+CACHE_KEY = 'bot:user:{telegram_id}'
+
+
+_local = LRUCache(
+    maxsize=getattr(settings, 'BOT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'BOT_USER_CACHE_LOCAL_TTL', 30),
+)
+
+
+def _from_user(user):
+    return UserContext(user.id, user.language, user.phone_number, user.is_active_bot)
+
+
+def remember_user(user):
+    """Put a freshly loaded or saved user into both cache tiers"""
+    if user.telegram_id is None:
+        return None
+    user_context = _from_user(user)
+    _local.set(user.telegram_id, user_context)
+    try:
+        cache.set(
+            CACHE_KEY.format(telegram_id=user.telegram_id),
+            tuple(user_context),
+            getattr(settings, 'BOT_USER_CACHE_TTL', 3600)
+        )
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {str(e)}")
+    return user_context
+
+
+def get_user_context(telegram_id):
+    """Resolve telegram_id to a UserContext, raising User.DoesNotExist if unknown"""
+    user_context = _local.get(telegram_id)
+    if user_context is not None:
+        return user_context
+
+    key = CACHE_KEY.format(telegram_id=telegram_id)
+    try:
+        cached = cache.get(key)
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {str(e)}")
+        cached = None
+
+    CACHE_REQUESTS.inc(cache='bot_user', result='miss' if cached is None else 'hit')
+    if cached is not None:
+        user_context = UserContext(*cached)
+        _local.set(telegram_id, user_context)
+        return user_context
+
+    user = User.objects.only('id', 'telegram_id', 'language', 'phone_number', 'is_active_bot').get(
+        telegram_id=telegram_id
+    )
+    return remember_user(user)
+
+
+def invalidate_user_context(telegram_id):
+    """Drop a user from both cache tiers after a write"""
+    if telegram_id is None:
+        return
+    _local.delete(telegram_id)
+    try:
+        cache.delete(CACHE_KEY.format(telegram_id=telegram_id))
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {str(e)}")
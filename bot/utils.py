@@ -1,5 +1,11 @@
 from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from collections import OrderedDict
+from types import MappingProxyType
+import json
 import logging
+import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -37,11 +43,22 @@ TEXTS = {
         'cart_cleared': "Savatcha tozalandi.",
         'language_changed': "Til o'zgartirildi!",
         'back': "⬅️ Orqaga",
+        'prev_page': "◀️ Oldingi",
+        'next_page': "Keyingi ▶️",
+        'all_products': "📦 Barcha mahsulotlar",
+        'search_results': "🔎 \"{query}\" bo'yicha topilgan mahsulotlar:",
+        'search_no_results': "🔎 \"{query}\" bo'yicha hech narsa topilmadi.",
+        'price_from': "{price} so'mdan",
         'orders': 'Mening buyurtmalarim',
         'your_orders': 'Sizning buyurtmalaringiz',
         'no_orders': 'Hozircha buyurtmalar yo‘q',
         'order_status_pending': 'Kutilmoqda',
+        'order_status_confirmed': 'Tasdiqlangan',
+        'order_status_processing': 'Tayyorlanmoqda',
+        'order_status_shipped': "Yo'lda",
+        'order_status_delivered': 'Yetkazib berilgan',
         'order_status_cancelled': 'Bekor qilingan',
+        'order_status_changed': "📦 Buyurtma #{order_id} holati o'zgardi: {status}",
         'cancel_order': 'Buyurtma #{order_id} bekor qilish',
         'order_cancelled': 'Buyurtma #{order_id} bekor qilindi',
         'error_order_not_found': 'Buyurtma topilmadi'
@@ -79,11 +96,22 @@ TEXTS = {
         'cart_cleared': "Корзина очищена.",
         'language_changed': "Язык изменен!",
         'back': "⬅️ Назад",
+        'prev_page': "◀️ Назад",
+        'next_page': "Далее ▶️",
+        'all_products': "📦 Все товары",
+        'search_results': "🔎 Найденные товары по запросу \"{query}\":",
+        'search_no_results': "🔎 По запросу \"{query}\" ничего не найдено.",
+        'price_from': "от {price} сум",
         'orders': 'Мои заказы',
         'your_orders': 'Ваши заказы',
         'no_orders': 'Пока нет заказов',
         'order_status_pending': 'В ожидании',
+        'order_status_confirmed': 'Подтверждён',
+        'order_status_processing': 'Собирается',
+        'order_status_shipped': 'В пути',
+        'order_status_delivered': 'Доставлен',
         'order_status_cancelled': 'Отменён',
+        'order_status_changed': '📦 Статус заказа #{order_id} изменён: {status}',
         'cancel_order': 'Отменить заказ #{order_id}',
         'order_cancelled': 'Заказ #{order_id} отменён',
         'error_order_not_found': 'Заказ не найден'
@@ -91,54 +119,263 @@ TEXTS = {
 }
 
 
+class TextCatalog:
+    """TEXTS compiled once into read-only per-language tables and bound format templates"""
+
+    def __init__(self, texts, default_language='uz'):
+        self.tables = {
+            language: MappingProxyType(dict(table))
+            for language, table in texts.items()
+        }
+        self.default = self.tables[default_language]
+        self.templates = {
+            language: MappingProxyType({
+                key: text.format for key, text in table.items() if '{' in text
+            })
+            for language, table in texts.items()
+        }
+        self.default_templates = self.templates[default_language]
+        self.trace = None
+
+    def get(self, key, language='uz'):
+        if self.trace is not None:
+            self.trace(key, language)
+        return self.tables.get(language, self.default).get(key, key)
+
+    def format(self, key, language='uz', **kwargs):
+        if self.trace is not None:
+            self.trace(key, language)
+        template = self.templates.get(language, self.default_templates).get(key)
+        if template is None:
+            return self.tables.get(language, self.default).get(key, key).format(**kwargs)
+        return template(**kwargs)
+
+    def menu_pattern(self, key):
+        """Regex matching the menu button text for key in any language"""
+        return re.compile('^(' + '|'.join(re.escape(table[key]) for table in self.tables.values()) + ')$')
+
+
+CATALOG = TextCatalog(TEXTS)
+
+MENU_PATTERNS = {
+    key: CATALOG.menu_pattern(key)
+    for key in ('categories', 'cart', 'language', 'orders')
+}
+
+
 def get_text(key, language='uz'):
     """Get translated text"""
-    logger.info(f"Fetching text for key: {key}, language: {language}")
-    return TEXTS.get(language, TEXTS['uz']).get(key, key)
+    return CATALOG.get(key, language)
+
+
+def format_text(key, language='uz', **kwargs):
+    """Get translated text with placeholders filled in"""
+    return CATALOG.format(key, language, **kwargs)
+
+
+def set_text_trace(enabled=True):
+    """Log every text lookup at DEBUG level; off by default to keep lookups cheap"""
+    def trace(key, language):
+        logger.debug(f"Fetching text for key: {key}, language: {language}")
+
+    CATALOG.trace = trace if enabled else None
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry TTL"""
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """InlineKeyboardMarkup serialized once so cached instances can be shared between updates"""
+
+    __slots__ = ('_json',)
+
+    def __init__(self, inline_keyboard, **kwargs):
+        super().__init__(inline_keyboard, **kwargs)
+        self._json = json.dumps(self.to_dict())
+
+    def to_json(self):
+        return self._json
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """ReplyKeyboardMarkup serialized once so cached instances can be shared between updates"""
+
+    __slots__ = ('_json',)
+
+    def __init__(self, keyboard, **kwargs):
+        super().__init__(keyboard, **kwargs)
+        self._json = json.dumps(self.to_dict())
+
+    def to_json(self):
+        return self._json
+
+
+_keyboards = LRUCache(maxsize=2048)
+
+
+def cached_keyboard(key, build, version=0):
+    """Return the keyboard memoized under key, rebuilding it when the catalog version changes"""
+    if version is None:
+        return build()
+
+    entry = _keyboards.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    markup = build()
+    _keyboards.set(key, (version, markup))
+    return markup
 
 
 def create_main_keyboard(language='uz'):
     """Create main menu keyboard"""
-    keyboard = [
-        [get_text('categories', language), get_text('cart', language)],
-        [get_text('orders', language), get_text('language', language)]
-    ]
-    logger.info(f"Main keyboard for {language}: {keyboard}")
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    def build():
+        keyboard = [
+            [get_text('categories', language), get_text('cart', language)],
+            [get_text('orders', language), get_text('language', language)]
+        ]
+        return FrozenReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+    return cached_keyboard(('main', language), build)
 
-def create_categories_keyboard(categories, language='uz', parent_id=None):
-    """Create categories inline keyboard"""
-    keyboard = []
 
-    for category in categories:
-        keyboard.append([InlineKeyboardButton(
-            category.get_name(language),
-            callback_data=f"cat_{category.id}"
-        )])
+def create_categories_keyboard(categories, language='uz', parent_id=None, version=None, browse_all=False):
+    """Create categories inline keyboard, memoized per catalog version when one is given"""
+    def build():
+        keyboard = []
+
+        for category in categories:
+            keyboard.append([InlineKeyboardButton(
+                category.get_name(language),
+                callback_data=f"cat_{category.id}"
+            )])
+
+        if parent_id and browse_all:
+            keyboard.append([InlineKeyboardButton(
+                get_text('all_products', language),
+                callback_data=f"pp_{parent_id}"
+            )])
+
+        if parent_id:
+            keyboard.append([InlineKeyboardButton(
+                get_text('back', language),
+                callback_data="back_to_categories"
+            )])
+
+        return FrozenInlineKeyboardMarkup(keyboard)
+
+    return cached_keyboard(('categories', language, parent_id, browse_all), build, version)
+
+
+def create_products_keyboard(page, language='uz', category_id=None, version=None, cursor=None):
+    """Create one page of the products inline keyboard, memoized per cursor and catalog version
+
+    page is a (products, before, after) tuple, or a callable returning one so a
+    cache hit skips the query; before/after are the (created_at_us, id) keyset
+    cursors of the neighbouring pages, or None at either end.
+    """
+    def build():
+        products, before, after = page() if callable(page) else page
+        keyboard = []
+
+        for product in products:
+            keyboard.append([InlineKeyboardButton(
+                product.get_name(language),
+                callback_data=f"prod_{product.id}"
+            )])
+
+        if category_id is not None:
+            navigation = []
+            if before:
+                navigation.append(InlineKeyboardButton(
+                    get_text('prev_page', language),
+                    callback_data=f"pp_{category_id}_p_{before[0]}_{before[1]}"
+                ))
+            if after:
+                navigation.append(InlineKeyboardButton(
+                    get_text('next_page', language),
+                    callback_data=f"pp_{category_id}_n_{after[0]}_{after[1]}"
+                ))
+            if navigation:
+                keyboard.append(navigation)
 
-    if parent_id:
         keyboard.append([InlineKeyboardButton(
             get_text('back', language),
             callback_data="back_to_categories"
         )])
 
-    return InlineKeyboardMarkup(keyboard)
+        return FrozenInlineKeyboardMarkup(keyboard)
 
+    if category_id is None:
+        return build()
+    return cached_keyboard(('products', language, category_id, cursor), build, version)
 
-def create_products_keyboard(products, language='uz'):
-    """Create products inline keyboard"""
-    keyboard = []
 
-    for product in products:
-        keyboard.append([InlineKeyboardButton(
-            product.get_name(language),
-            callback_data=f"prod_{product.id}"
-        )])
+def create_cart_keyboard(language='uz'):
+    """Create cart actions inline keyboard"""
+    def build():
+        keyboard = [
+            [InlineKeyboardButton(get_text('place_order', language), callback_data="place_order")],
+            [InlineKeyboardButton(get_text('clear_cart', language), callback_data="clear_cart")],
+            [InlineKeyboardButton(get_text('continue_shopping', language), callback_data="back_to_categories")]
+        ]
+        return FrozenInlineKeyboardMarkup(keyboard)
+
+    return cached_keyboard(('cart', language), build)
+
+
+def format_cart(summary, language='uz'):
+    """Render a cart summary from shop.services.build_cart_summary as Markdown text"""
+    parts = [get_text('your_cart', language), "\n\n"]
 
-    keyboard.append([InlineKeyboardButton(
-        get_text('back', language),
-        callback_data="back_to_categories"
-    )])
+    for item in summary.items:
+        color = item.product_color
+        parts.append(f"• {color.product.get_name(language)}\n")
+        parts.append(f"  {color.get_name(language)}\n")
+        parts.append(f"  {item.quantity} x {color.price} = {item.line_total} so'm\n\n")
 
-    return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+    parts.append(f"*{get_text('total', language)}: {summary.total} so'm*")
+    return ''.join(parts)
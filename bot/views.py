@@ -1,14 +1,43 @@
+from django.conf import settings
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
+import hmac
 import json
+import logging
+
+from .update_queue import enqueue_update
+
+logger = logging.getLogger(__name__)
+
 
 @csrf_exempt
 @require_POST
 def webhook(request):
-    """Webhook endpoint for Telegram bot"""
+    """Webhook endpoint for Telegram bot
+
+    Only validates the update and queues it; consume_updates processes dispatch it.
+    """
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret:
+        # Without a secret anyone could post updates as any user
+        logger.error("TELEGRAM_WEBHOOK_SECRET is not set, refusing webhook updates")
+        return HttpResponse("Forbidden", status=403)
+    if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret):
+        return HttpResponse("Forbidden", status=403)
+
     try:
         data = json.loads(request.body)
-        return HttpResponse("OK")
+        if not isinstance(data, dict) or 'update_id' not in data:
+            raise ValueError("update_id is missing")
     except Exception as e:
         return HttpResponse(f"Error: {str(e)}", status=400)
+
+    try:
+        enqueue_update(data, request.body)
+    except Exception as e:
+        # Telegram retries the update on non-2xx responses
+        logger.error(f"Failed to queue update {data['update_id']}: {str(e)}")
+        return HttpResponse("Queue unavailable", status=503)
+
+    return HttpResponse("OK")
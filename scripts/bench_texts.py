@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for bot text lookups
+Compares the old get_text (dict lookups + INFO log per call) with the compiled TextCatalog
+on a typical update that looks up and formats a handful of texts.
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils import TEXTS, get_text, format_text
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+    stream=open(os.devnull, 'w')
+)
+logger = logging.getLogger('bot.utils')
+
+
+def legacy_get_text(key, language='uz'):
+    logger.info(f"Fetching text for key: {key}, language: {language}")
+    return TEXTS.get(language, TEXTS['uz']).get(key, key)
+
+
+def legacy_update(language):
+    legacy_get_text('your_cart', language)
+    legacy_get_text('total', language)
+    legacy_get_text('place_order', language)
+    legacy_get_text('clear_cart', language)
+    legacy_get_text('continue_shopping', language)
+    legacy_get_text('item_added_to_cart', language).format(product='iPhone 15 Pro', color='Qora', price=15000000)
+    legacy_get_text('order_created', language).format(order_id=12345, total=15000000)
+
+
+def compiled_update(language):
+    get_text('your_cart', language)
+    get_text('total', language)
+    get_text('place_order', language)
+    get_text('clear_cart', language)
+    get_text('continue_shopping', language)
+    format_text('item_added_to_cart', language, product='iPhone 15 Pro', color='Qora', price=15000000)
+    format_text('order_created', language, order_id=12345, total=15000000)
+
+
+def bench(func, number):
+    best = min(timeit.repeat(lambda: (func('uz'), func('ru')), number=number, repeat=5))
+    return best / (number * 2) * 1e6
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    before = bench(legacy_update, number)
+    after = bench(compiled_update, number)
+    print("Per-update text overhead (7 lookups, 2 formatted):")
+    print(f"  before: {before:8.2f} us")
+    print(f"  after:  {after:8.2f} us")
+    print(f"  speedup: {before / after:.1f}x")
@@ -1,6 +1,7 @@
 """
 Sample data creation script for Telegram Shop Bot
 Run this script to populate the database with sample categories and products
+For large synthetic volumes use `python manage.py generate_data` instead
 """
 
 import os
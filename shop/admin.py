@@ -1,7 +1,54 @@
+import time
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
-from .models import User, Category, Product, ProductColor, ProductColorImage, Cart, Order, OrderItem
+from .models import User, Category, Product, ProductColor, ProductColorImage, Cart, Order, OrderItem, Broadcast
+from .services import LINE_TOTAL
+
+
+# Seconds a table's reltuples estimate is reused before pg_class is read again
+ESTIMATE_TTL = 300
+
+# (database alias, table) -> (reltuples or None, time read)
+_estimates = {}
+
+
+class EstimatedCountPaginator(Paginator):
+    """Takes the size of an unfiltered PostgreSQL table from the planner statistics
+
+    COUNT(*) reads the whole table, while pg_class.reltuples is kept close by
+    autovacuum, which is good enough for page links. Filtered lists and small
+    tables are still counted exactly. The estimate is kept for ESTIMATE_TTL, so
+    a small table costs one COUNT(*) per page rather than a pg_class read as well.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            estimate = self.estimate(connection, queryset.model._meta.db_table)
+            if estimate is not None and estimate >= self.threshold:
+                return int(estimate)
+        return super().count
+
+    @staticmethod
+    def estimate(connection, table):
+        key = (connection.alias, table)
+        cached = _estimates.get(key)
+        if cached is not None and time.monotonic() - cached[1] < ESTIMATE_TTL:
+            return cached[0]
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+        estimate = row[0] if row else None
+        _estimates[key] = (estimate, time.monotonic())
+        return estimate
 
 
 @admin.register(User)
@@ -9,6 +56,8 @@ class UserAdmin(BaseUserAdmin):
     list_display = ('username', 'telegram_id', 'phone_number', 'language', 'is_active_bot', 'date_joined')
     list_filter = ('language', 'is_active_bot', 'is_staff', 'is_superuser')
     search_fields = ('username', 'telegram_id', 'phone_number')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = BaseUserAdmin.fieldsets + (
         (_('Telegram Info'), {'fields': ('telegram_id', 'phone_number', 'language', 'is_active_bot')}),
@@ -17,13 +66,15 @@ class UserAdmin(BaseUserAdmin):
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name_uz', 'name_ru', 'parent', 'is_active', 'order', 'level')
-    list_filter = ('is_active', 'parent')
+    list_filter = ('is_active', 'depth')
+    list_select_related = ('parent',)
     search_fields = ('name_uz', 'name_ru')
     list_editable = ('order', 'is_active')
+    autocomplete_fields = ('parent',)
     
+    @admin.display(description=_('Level'), ordering='depth')
     def level(self, obj):
-        return obj.level
-    level.short_description = _('Level')
+        return obj.depth
 
 admin.site.register(Category, CategoryAdmin)
 
@@ -45,32 +96,69 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('name_uz', 'name_ru')
     filter_horizontal = ('categories',)
     inlines = [ProductColorInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(ProductColor)
 class ProductColorAdmin(admin.ModelAdmin):
     list_display = ('product', 'name_uz', 'name_ru', 'price', 'is_available')
-    list_filter = ('is_available', 'product')
+    list_filter = ('is_available',)
+    list_select_related = ('product',)
     search_fields = ('name_uz', 'name_ru', 'product__name_uz')
+    autocomplete_fields = ('product',)
     inlines = [ProductColorImageInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ('user', 'product_color', 'quantity', 'total_price', 'created_at')
     list_filter = ('created_at',)
+    list_select_related = ('user', 'product_color__product')
     search_fields = ('user__username', 'product_color__product__name_uz')
+    autocomplete_fields = ('user', 'product_color')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(line_total=LINE_TOTAL)
+
+    @admin.display(description=_('Total price'), ordering='line_total')
+    def total_price(self, obj):
+        return obj.line_total
 
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ('total_price',)
+    autocomplete_fields = ('product_color',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product_color__product')
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'status', 'total_amount', 'created_at')
-    list_filter = ('status', 'created_at')
+    list_filter = ('status',)
+    list_select_related = ('user',)
+    # Drills down on order_created_idx
+    date_hierarchy = 'created_at'
     search_fields = ('user__username', 'phone_number')
     list_editable = ('status',)
+    autocomplete_fields = ('user',)
     inlines = [OrderItemInline]
     readonly_fields = ('created_at', 'updated_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'sent_count', 'failed_count', 'blocked_count', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = (
+        'status', 'error', 'last_user_id', 'sent_count', 'failed_count', 'blocked_count',
+        'created_at', 'started_at', 'finished_at'
+    )
@@ -0,0 +1,318 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import logging
+
+from .models import (
+    Category, DailyCategorySales, DailyNewUsers, DailyOrderStats, DailyProductSales,
+    Order, OrderItem, Product, ProductColor, User
+)
+
+logger = logging.getLogger(__name__)
+
+# Counter fields of every rollup; the other fields identify a row
+COUNTERS = {
+    DailyOrderStats: ('orders', 'revenue'),
+    DailyProductSales: ('units', 'revenue'),
+    DailyCategorySales: ('units', 'revenue'),
+    DailyNewUsers: ('users',),
+}
+
+# Orders in this status count in DailyOrderStats but not as sales
+CANCELLED = 'cancelled'
+
+ITEM_TOTAL = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=16, decimal_places=2))
+
+# Rows per INSERT ... ON CONFLICT statement
+BATCH_SIZE = 200
+
+
+def increment(model, rows):
+    """Add counter deltas to rollup rows, creating the rows that do not exist yet
+
+    rows maps a tuple of the model's identifying field values, in field order,
+    to a tuple of deltas in COUNTERS order. Runs INSERT ... ON CONFLICT DO UPDATE,
+    which PostgreSQL and SQLite both support; rows go in key order so concurrent
+    transactions lock them in the same order.
+    """
+    counters = COUNTERS[model]
+    keys = [field for field in model._meta.concrete_fields if not field.primary_key and field.name not in counters]
+    fields = keys + [model._meta.get_field(name) for name in counters]
+    unique = model._meta.constraints[0].fields
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in fields)
+    target = ', '.join(quote(model._meta.get_field(name).column) for name in unique)
+    updates = ', '.join(
+        f'{quote(field.column)} = {table}.{quote(field.column)} + EXCLUDED.{quote(field.column)}'
+        for field in fields[len(keys):]
+    )
+    row_sql = f"({', '.join(['%s'] * len(fields))})"
+
+    rows = sorted((key + deltas for key, deltas in rows.items() if any(deltas)), key=lambda row: row[:len(keys)])
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            params = [field.get_db_prep_save(value, connection) for row in batch for field, value in zip(fields, row)]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_sql] * len(batch))} "
+                f"ON CONFLICT ({target}) DO UPDATE SET {updates}",
+                params
+            )
+
+
+def apply(deltas):
+    """Write {model: rows} deltas, as taken by increment, in one transaction
+
+    Called after the order or user change committed; a failure is logged rather than
+    raised, and backfill_analytics repairs the days it missed.
+    """
+    try:
+        with transaction.atomic():
+            for model, rows in deltas.items():
+                if rows:
+                    increment(model, rows)
+    except Exception as e:
+        logger.error(f"Could not update analytics rollups: {str(e)}")
+
+
+def sales_deltas(order_ids, day, sign=1):
+    """DailyProductSales and DailyCategorySales deltas for the items of orders placed on day"""
+    products = defaultdict(lambda: [0, Decimal('0')])
+    items = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values_list('product_color_id', 'product_color__product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(ITEM_TOTAL))
+        .order_by()
+    )
+    for color_id, product_id, units, revenue in items:
+        totals = products[(day, color_id, product_id)]
+        totals[0] += sign * units
+        totals[1] += sign * revenue
+
+    categories = defaultdict(lambda: [0, Decimal('0')])
+    if products:
+        product_categories = defaultdict(list)
+        for product_id, category_id in Product.categories.through.objects.filter(
+            product_id__in={product_id for _, _, product_id in products}
+        ).values_list('product_id', 'category_id'):
+            product_categories[product_id].append(category_id)
+        for (_, _, product_id), (units, revenue) in products.items():
+            for category_id in product_categories[product_id]:
+                totals = categories[(day, category_id)]
+                totals[0] += units
+                totals[1] += revenue
+
+    return {
+        DailyProductSales: {key: tuple(totals) for key, totals in products.items()},
+        DailyCategorySales: {key: tuple(totals) for key, totals in categories.items()},
+    }
+
+
+def order_deltas(order, status, sign=1):
+    """Rollup deltas of an order counted (sign 1) or uncounted (sign -1) in status"""
+    day = timezone.localdate(order.created_at)
+    deltas = {DailyOrderStats: {(day, status): (sign, sign * order.total_amount)}}
+    if status != CANCELLED:
+        deltas.update(sales_deltas([order.pk], day, sign))
+    return deltas
+
+
+def record_order_created(order_id, status):
+    """Count a new order; runs on commit, once place_order has added its items"""
+    order = Order.objects.only('id', 'created_at', 'total_amount').filter(pk=order_id).first()
+    if order is not None:
+        apply(order_deltas(order, status))
+
+
+def record_status_change(order, previous, status):
+    """Move an order from its previous status row to the new one
+
+    Sales change only when the order is cancelled or taken back from cancelled.
+    """
+    day = timezone.localdate(order.created_at)
+    deltas = {DailyOrderStats: {
+        (day, previous): (-1, -order.total_amount),
+        (day, status): (1, order.total_amount),
+    }}
+    if CANCELLED in (previous, status):
+        deltas.update(sales_deltas([order.pk], day, -1 if status == CANCELLED else 1))
+    apply(deltas)
+
+
+def record_user_joined(user):
+    apply({DailyNewUsers: {(timezone.localdate(user.created_at), user.language): (1,)}})
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(first, last):
+    """Recompute the rollups of days first to last (inclusive) from orders and users
+
+    The days are cleared and aggregated again in one transaction, so the result
+    does not depend on what the rollups held before. Returns the number of rows written.
+    """
+    since, until = day_start(first), day_start(last + timedelta(days=1))
+    day = TruncDate('created_at')
+    order_day = TruncDate('order__created_at')
+
+    with transaction.atomic():
+        for model in COUNTERS:
+            model.objects.filter(day__gte=first, day__lte=last).delete()
+
+        orders = (
+            Order.objects.filter(created_at__gte=since, created_at__lt=until)
+            .values('status', day=day)
+            .annotate(count=Count('id'), revenue=Sum('total_amount'))
+            .order_by()
+        )
+        items = OrderItem.objects.filter(
+            order__created_at__gte=since, order__created_at__lt=until
+        ).exclude(order__status=CANCELLED)
+        products = (
+            items.values('product_color_id', product_id=F('product_color__product_id'), day=order_day)
+            .annotate(units=Sum('quantity'), revenue=Sum(ITEM_TOTAL))
+            .order_by()
+        )
+        categories = (
+            items.filter(product_color__product__categories__isnull=False)
+            .values(category_id=F('product_color__product__categories'), day=order_day)
+            .annotate(units=Sum('quantity'), revenue=Sum(ITEM_TOTAL))
+            .order_by()
+        )
+        users = (
+            User.objects.filter(created_at__gte=since, created_at__lt=until)
+            .values('language', day=day)
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+
+        rollups = [
+            DailyOrderStats.objects.bulk_create([
+                DailyOrderStats(day=row['day'], status=row['status'], orders=row['count'], revenue=row['revenue'])
+                for row in orders
+            ], batch_size=1000),
+            DailyProductSales.objects.bulk_create([
+                DailyProductSales(
+                    day=row['day'], product_color_id=row['product_color_id'], product_id=row['product_id'],
+                    units=row['units'], revenue=row['revenue']
+                )
+                for row in products
+            ], batch_size=1000),
+            DailyCategorySales.objects.bulk_create([
+                DailyCategorySales(
+                    day=row['day'], category_id=row['category_id'], units=row['units'], revenue=row['revenue']
+                )
+                for row in categories
+            ], batch_size=1000),
+            DailyNewUsers.objects.bulk_create([
+                DailyNewUsers(day=row['day'], language=row['language'], users=row['count'])
+                for row in users
+            ], batch_size=1000),
+        ]
+    return sum(len(rows) for rows in rollups)
+
+
+def parse_day_range(params, default_days=30):
+    """First and last day from date_from/date_to (YYYY-MM-DD, inclusive); the last default_days by default
+
+    Raises ValueError for a malformed or reversed range.
+    """
+    days = {}
+    for name in ('date_from', 'date_to'):
+        value = params.get(name)
+        if value:
+            days[name] = parse_date(value)
+            if days[name] is None:
+                raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+    last = days.get('date_to') or timezone.localdate()
+    first = days.get('date_from') or last - timedelta(days=default_days - 1)
+    if first > last:
+        raise ValueError('date_from must not be after date_to')
+    return first, last
+
+
+def each_day(first, last):
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def order_summary(first, last):
+    """Orders per status and revenue (not counting cancelled orders) of every day"""
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    days = {day: {'orders': dict.fromkeys(statuses, 0), 'revenue': Decimal('0')} for day in each_day(first, last)}
+    rows = DailyOrderStats.objects.filter(day__gte=first, day__lte=last).values_list('day', 'status', 'orders', 'revenue')
+    for day, status, orders, revenue in rows:
+        days[day]['orders'][status] = orders
+        if status != CANCELLED:
+            days[day]['revenue'] += revenue
+
+    total = {'orders': dict.fromkeys(statuses, 0), 'revenue': Decimal('0')}
+    for stats in days.values():
+        for status, orders in stats['orders'].items():
+            total['orders'][status] += orders
+        total['revenue'] += stats['revenue']
+    return [{'day': day, **stats} for day, stats in days.items()], total
+
+
+def top_products(first, last, limit=10, by='product'):
+    """Best selling products (or product colors, by='color') by units over the days"""
+    field = 'product_color_id' if by == 'color' else 'product_id'
+    rows = list(
+        DailyProductSales.objects.filter(day__gte=first, day__lte=last)
+        .values(field)
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .filter(units__gt=0)
+        .order_by('-units', '-revenue', field)[:limit]
+    )
+    ids = [row[field] for row in rows]
+    if by == 'color':
+        colors = ProductColor.objects.select_related('product').in_bulk(ids)
+        for row in rows:
+            color = colors.get(row[field])
+            row['product_id'] = color.product_id if color else None
+            row['name_uz'] = f"{color.product.name_uz} - {color.name_uz}" if color else ''
+            row['name_ru'] = f"{color.product.name_ru} - {color.name_ru}" if color else ''
+    else:
+        products = Product.objects.only('name_uz', 'name_ru').in_bulk(ids)
+        for row in rows:
+            product = products.get(row[field])
+            row['name_uz'] = product.name_uz if product else ''
+            row['name_ru'] = product.name_ru if product else ''
+    return rows
+
+
+def top_categories(first, last, limit=10):
+    """Categories whose products sold the most units over the days"""
+    rows = list(
+        DailyCategorySales.objects.filter(day__gte=first, day__lte=last)
+        .values('category_id')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .filter(units__gt=0)
+        .order_by('-units', '-revenue', 'category_id')[:limit]
+    )
+    names = Category.objects.only('name_uz', 'name_ru').in_bulk([row['category_id'] for row in rows])
+    for row in rows:
+        category = names.get(row['category_id'])
+        row['name_uz'] = category.name_uz if category else ''
+        row['name_ru'] = category.name_ru if category else ''
+    return rows
+
+
+def new_users(first, last):
+    """Users who joined on every day, by language"""
+    languages = [language for language, _ in User._meta.get_field('language').choices]
+    days = {day: dict.fromkeys(languages, 0) for day in each_day(first, last)}
+    for day, language, users in DailyNewUsers.objects.filter(
+        day__gte=first, day__lte=last
+    ).values_list('day', 'language', 'users'):
+        days[day][language] = days[day].get(language, 0) + users
+    return [{'day': day, 'users': users, 'total': sum(users.values())} for day, users in days.items()]
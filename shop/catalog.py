@@ -0,0 +1,267 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+import logging
+
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    """Current catalog version shared by all processes through Redis"""
+    try:
+        return cache.get(VERSION_KEY, 0)
+    except Exception as e:
+        logger.warning(f"Catalog version unavailable: {str(e)}")
+        return None
+
+
+def bump_catalog_version():
+    """Invalidate every process's catalog snapshot"""
+    global _tree
+    _tree = None
+    try:
+        cache.add(VERSION_KEY, 0, None)
+        return cache.incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Catalog version unavailable: {str(e)}")
+        return None
+
+
+def rebuild_category_paths(using='default', batch_size=1000):
+    """Recompute the materialized path and depth of every category
+
+    Returns the number of categories changed and the total. Raises ValueError if
+    a category is its own ancestor.
+    """
+    rows = list(Category.objects.using(using).values_list('id', 'parent_id', 'path', 'depth'))
+    parents = {pk: parent_id for pk, parent_id, path, depth in rows}
+
+    computed = {}
+    for pk in parents:
+        chain = []
+        node = pk
+        while node is not None and node not in computed:
+            if node in chain:
+                raise ValueError(f'Category {node} is its own ancestor, fix its parent first')
+            chain.append(node)
+            node = parents.get(node)
+        prefix, depth = computed[node] if node is not None else ('/', -1)
+        for node in reversed(chain):
+            depth += 1
+            prefix = f'{prefix}{node}/'
+            computed[node] = (prefix, depth)
+
+    changed = [
+        Category(id=pk, path=computed[pk][0], depth=computed[pk][1])
+        for pk, parent_id, path, depth in rows
+        if (path, depth) != computed[pk]
+    ]
+    with transaction.atomic(using=using):
+        Category.objects.using(using).bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+    return len(changed), len(rows)
+
+
+class CategoryNode:
+    """Read-only snapshot of an active category"""
+
+    __slots__ = ('id', 'name_uz', 'name_ru', 'parent_id', 'path', 'order', 'product_count', 'children', '_sorted')
+
+    def __init__(self, id, name_uz, name_ru, parent_id, path, order, product_count):
+        self.id = id
+        self.name_uz = name_uz
+        self.name_ru = name_ru
+        self.parent_id = parent_id
+        self.path = path
+        self.order = order
+        self.product_count = product_count
+        self.children = ()
+        self._sorted = {}
+
+    def __repr__(self):
+        return f"<CategoryNode {self.id}: {self.name_uz}>"
+
+    def get_name(self, language='uz'):
+        return getattr(self, f'name_{language}', self.name_uz)
+
+    @property
+    def is_leaf(self):
+        return not self.children
+
+    def get_children(self, language='uz'):
+        return self._sorted.get(language, self.children)
+
+
+class CategoryTree:
+    """Active categories as a parent -> children adjacency built in one query"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.nodes = {row['id']: CategoryNode(**row) for row in rows}
+
+        children = {}
+        for node in self.nodes.values():
+            children.setdefault(node.parent_id, []).append(node)
+
+        for node in self.nodes.values():
+            node.children = tuple(children.get(node.id, ()))
+        self.root_nodes = tuple(children.get(None, ()))
+
+        languages = [code for code, name in settings.LANGUAGES]
+        self._roots = {}
+        for language in languages:
+            self._roots[language] = self._sort(self.root_nodes, language)
+            for node in self.nodes.values():
+                node._sorted[language] = self._sort(node.children, language)
+
+    @staticmethod
+    def _sort(nodes, language):
+        return tuple(sorted(nodes, key=lambda node: (node.order, node.get_name(language))))
+
+    @classmethod
+    def build(cls, version=None):
+        rows = (
+            Category.objects.filter(is_active=True)
+            .order_by()
+            .values('id', 'name_uz', 'name_ru', 'parent_id', 'path', 'order')
+            .annotate(product_count=Count('products', filter=Q(products__is_active=True)))
+        )
+        return cls(rows, version=version)
+
+    def roots(self, language='uz'):
+        return self._roots.get(language, self.root_nodes)
+
+    def get(self, category_id):
+        """Return an active, reachable category node or raise Category.DoesNotExist"""
+        node = self.nodes.get(category_id)
+        if node is None or not self.is_reachable(node):
+            raise Category.DoesNotExist(f"Category {category_id} not found")
+        return node
+
+    def is_reachable(self, node):
+        while node.parent_id is not None:
+            node = self.nodes.get(node.parent_id)
+            if node is None:
+                return False
+        return True
+
+
+_tree = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_category_tree():
+    """Return the process-wide category snapshot, rebuilding it after a version bump"""
+    global _tree, _checked_at
+
+    tree = _tree
+    now = time.monotonic()
+    if tree is not None and now - _checked_at < getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1):
+        return tree
+
+    with _lock:
+        version = get_catalog_version()
+        _checked_at = time.monotonic()
+        if _tree is None or _tree.version != version or version is None:
+            _tree = CategoryTree.build(version=version)
+            logger.info(f"Category tree rebuilt: {len(_tree.nodes)} categories, version {version}")
+        return _tree
+
+
+def attach_category_relations(categories):
+    """Preload what CategorySerializer reads from category instances
+
+    Sets active_children (recursively) on every instance from the tree
+    snapshot, loading the missing descendants in a single query.
+    """
+    categories = list(categories)
+    if not categories:
+        return
+    tree = get_category_tree()
+
+    loaded = {}
+    needed = set()
+    for category in categories:
+        loaded.setdefault(category.id, category)
+        node = tree.nodes.get(category.id)
+        if node is None:
+            continue
+        stack = list(node.children)
+        while stack:
+            child = stack.pop()
+            needed.add(child.id)
+            stack.extend(child.children)
+
+    missing = needed - loaded.keys()
+    if missing:
+        for category in Category.objects.filter(id__in=missing):
+            loaded[category.id] = category
+
+    for instance in categories + list(loaded.values()):
+        node = tree.nodes.get(instance.id)
+        if node is None:
+            continue
+        instance.active_children = [loaded[child.id] for child in node.get_children() if child.id in loaded]
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+ProductPage = namedtuple('ProductPage', ['products', 'before', 'after'])
+
+
+def product_cursor(product):
+    """Keyset position of a product: (created_at in microseconds since epoch, id)"""
+    return (product.created_at - EPOCH) // timedelta(microseconds=1), product.id
+
+
+def get_product_page(category, cursor=None, backwards=False, size=None, subtree=None):
+    """One page of a category's active products, newest first
+
+    Seeks past cursor on (created_at, id) instead of using OFFSET, so every page
+    is one indexed query however deep the user pages. With backwards the page
+    ending just before cursor is returned. before/after are the cursors to pass
+    back for the neighbouring pages, or None when there is none.
+    """
+    size = size or settings.BOT_PRODUCTS_PAGE_SIZE
+    if subtree is None:
+        subtree = settings.BOT_BROWSE_SUBTREE
+
+    links = Product.categories.through.objects.filter(product_id=OuterRef('pk'))
+    # An empty path (not computed yet) would match every category
+    if subtree and category.path:
+        links = links.filter(category__path__startswith=category.path, category__is_active=True)
+    else:
+        links = links.filter(category_id=category.id)
+    products = Product.objects.filter(Exists(links), is_active=True).only('id', 'name_uz', 'name_ru', 'created_at')
+
+    if cursor is not None:
+        created_at, pk = EPOCH + timedelta(microseconds=cursor[0]), cursor[1]
+        if backwards:
+            products = products.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        else:
+            products = products.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    order = ('created_at', 'id') if backwards else ('-created_at', '-id')
+    rows = list(products.order_by(*order)[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    has_before = more if backwards else cursor is not None
+    has_after = cursor is not None if backwards else more
+    return ProductPage(
+        rows,
+        product_cursor(rows[0]) if rows and has_before else None,
+        product_cursor(rows[-1]) if rows and has_after else None,
+    )
@@ -0,0 +1,119 @@
+import hashlib
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Model label -> (image field, field caching its Telegram file_id, field listing its variants)
+IMAGE_FIELDS = {
+    'shop.Product': ('main_image', 'main_image_file_id', 'main_image_variants'),
+    'shop.Category': ('image', None, 'image_variants'),
+    'shop.ProductColorImage': ('image', 'file_id', 'image_variants'),
+    'shop.Broadcast': ('image', 'image_file_id', 'image_variants'),
+}
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+
+def render_variant(source, spec):
+    """Resize and re-encode one variant; metadata is not copied over"""
+    image = source.copy()
+    image.thumbnail((spec['size'], spec['size']), Image.LANCZOS)
+
+    if spec['format'] == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    output = BytesIO()
+    image.save(output, spec['format'], quality=spec.get('quality', 85), optimize=True)
+    return image.size, output.getvalue()
+
+
+def build_variants(field_file):
+    """Write every IMAGE_VARIANTS rendition of an image under a content-hashed name"""
+    field_file.open('rb')
+    try:
+        data = field_file.read()
+    finally:
+        field_file.close()
+
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    variants = {}
+
+    with Image.open(BytesIO(data)) as original:
+        source = ImageOps.exif_transpose(original)
+        for name, spec in settings.IMAGE_VARIANTS.items():
+            path = f"derivatives/{digest}_{name}.{EXTENSIONS[spec['format']]}"
+            (width, height), content = render_variant(source, spec)
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(content))
+            variants[name] = {'name': path, 'width': width, 'height': height, 'bytes': len(content)}
+
+    return variants
+
+
+def generate_variants(model_label, pk, force=False):
+    """Build and store the variants of one object's image; returns True if anything was written"""
+    model = apps.get_model(model_label)
+    image_field, file_id_field, variants_field = IMAGE_FIELDS[model_label]
+
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return False
+    image = getattr(instance, image_field)
+    if not image or (getattr(instance, variants_field) and not force):
+        return False
+
+    try:
+        variants = build_variants(image)
+    except Exception as e:
+        logger.error(f"Could not build image variants for {model_label} {pk}: {str(e)}")
+        return False
+
+    # Skip the write if the image was replaced while we were resizing it
+    updated = model.objects.filter(pk=pk, **{image_field: image.name}).update(**{variants_field: variants})
+    return bool(updated)
+
+
+def schedule_variants(model_label, pk):
+    """Generate variants in a Celery worker, or inline when IMAGE_VARIANTS_ASYNC is off"""
+    if settings.IMAGE_VARIANTS_ASYNC:
+        from .tasks import generate_image_variants
+        try:
+            generate_image_variants.delay(model_label, pk)
+            return
+        except Exception as e:
+            logger.error(f"Could not queue image variants for {model_label} {pk}: {str(e)}")
+    generate_variants(model_label, pk)
+
+
+def pick_variant(variants, size=None):
+    """Smallest variant whose longer side covers size, or the largest one without a size"""
+    if not variants:
+        return None
+    ordered = sorted(variants.values(), key=lambda variant: max(variant['width'], variant['height']))
+    if size:
+        for variant in ordered:
+            if max(variant['width'], variant['height']) >= size:
+                return variant
+    return ordered[-1]
+
+
+def open_for_telegram(instance, image_field, variants_field):
+    """Open the Telegram variant of an image if it exists, otherwise the original"""
+    variant = (getattr(instance, variants_field) or {}).get('telegram')
+    if variant and default_storage.exists(variant['name']):
+        return default_storage.open(variant['name'], 'rb')
+    image = getattr(instance, image_field)
+    image.open('rb')
+    return image
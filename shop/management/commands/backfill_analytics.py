@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from shop.analytics import parse_day_range, rebuild
+from shop.models import Order, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the daily analytics rollups from orders and users, a few days per transaction; '
+        'safe to run again, every day is recomputed from scratch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='First day to rebuild (YYYY-MM-DD); the first order or user by default')
+        parser.add_argument('--date-to', help='Last day to rebuild (YYYY-MM-DD); today by default')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days aggregated per transaction')
+
+    def handle(self, *args, **options):
+        date_from = options['date_from']
+        if not date_from:
+            oldest = [
+                value for value in (
+                    Order.objects.aggregate(first=Min('created_at'))['first'],
+                    User.objects.aggregate(first=Min('created_at'))['first'],
+                ) if value
+            ]
+            if not oldest:
+                self.stdout.write('Nothing to aggregate')
+                return
+            date_from = timezone.localdate(min(oldest)).isoformat()
+
+        try:
+            first, last = parse_day_range({'date_from': date_from, 'date_to': options['date_to']})
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        chunk_days = max(1, options['chunk_days'])
+        rows = 0
+        day = first
+        while day <= last:
+            until = min(day + timedelta(days=chunk_days - 1), last)
+            rows += rebuild(day, until)
+            self.stdout.write(f'{until}: {rows} rollup rows', ending='\r')
+            day = until + timedelta(days=1)
+        self.stdout.write('')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {(last - first).days + 1} days from {first} to {last}: '
+            f'{rows} rollup rows in {time.perf_counter() - started:.1f}s'
+        ))
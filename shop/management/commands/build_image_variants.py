@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.imaging import IMAGE_FIELDS, generate_variants
+
+
+def _build(job):
+    model_label, pk, force = job
+    return generate_variants(model_label, pk, force=force)
+
+
+class Command(BaseCommand):
+    help = 'Build resized image variants for existing media, in parallel across cores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that already exist')
+        parser.add_argument('--model', choices=sorted(IMAGE_FIELDS), help='Only process one model')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model_label, (image_field, file_id_field, variants_field) in IMAGE_FIELDS.items():
+            if options['model'] and model_label != options['model']:
+                continue
+            queryset = apps.get_model(model_label).objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+            if not options['force']:
+                queryset = queryset.filter(**{variants_field: {}})
+            jobs.extend((model_label, pk, options['force']) for pk in queryset.values_list('pk', flat=True).iterator())
+
+        if not jobs:
+            self.stdout.write('Nothing to do')
+            return
+
+        # Each worker process opens its own database connection
+        connections.close_all()
+
+        built = 0
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            for done in pool.imap_unordered(_build, jobs, chunksize=16):
+                built += done
+
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {built} of {len(jobs)} images'))
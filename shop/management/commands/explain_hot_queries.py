@@ -0,0 +1,143 @@
+import re
+import statistics
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from shop.models import Category, Product, ProductColor, Order
+
+User = get_user_model()
+
+EXECUTION_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN ANALYZE on the hot catalog and order queries with and without the indexes that serve them. '
+        'Indexes are dropped inside a rolled back transaction, which locks the tables: never run it on production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Insert synthetic data with generate_data first')
+        parser.add_argument('--categories', type=int, default=2000)
+        parser.add_argument('--products', type=int, default=200000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=500000)
+        parser.add_argument('--repeat', type=int, default=5, help='EXPLAIN ANALYZE runs per query; the median is reported')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE comparisons need PostgreSQL')
+
+        if options['seed']:
+            call_command(
+                'generate_data', users=options['users'], categories=options['categories'],
+                products=options['products'], colors=options['products'] * 3, orders=options['orders'],
+                stdout=self.stdout
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        existing = self.existing_indexes()
+        for name, queryset, indexes in self.hot_queries():
+            missing = [index for index in indexes if index not in existing]
+            if missing:
+                self.stdout.write(self.style.WARNING(f"{name}: index {', '.join(missing)} not in the database, run migrate"))
+                continue
+
+            after, after_plan = self.measure(queryset, options['repeat'])
+            before, before_plan = self.measure(queryset, options['repeat'], drop=indexes)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name} ({', '.join(indexes)})"))
+            self.stdout.write(f"  without: {before:8.2f} ms  {before_plan[0].strip()}")
+            self.stdout.write(f"  with:    {after:8.2f} ms  {after_plan[0].strip()}")
+            if options['verbosity'] > 1:
+                self.stdout.write('\n'.join(f'    {line}' for line in before_plan))
+                self.stdout.write('\n'.join(f'    {line}' for line in after_plan))
+
+    def hot_queries(self):
+        """(name, queryset, indexes justified by it) for the queries the bot and API run most"""
+        parent_id = (
+            Category.objects.filter(is_active=True, children__isnull=False)
+            .values_list('id', flat=True).order_by('?').first()
+        )
+        product = Product.objects.filter(is_active=True).order_by('?').only('id', 'created_at').first()
+        user_id = Order.objects.values_list('user_id', flat=True).order_by('?').first()
+
+        queries = [
+            (
+                'category children',
+                Category.objects.filter(parent_id=parent_id, is_active=True).order_by('order', 'name_uz'),
+                ['category_active_parent_idx'],
+            ),
+            (
+                'root categories',
+                Category.objects.filter(parent__isnull=True, is_active=True).order_by('order', 'name_uz'),
+                ['category_active_parent_idx'],
+            ),
+            (
+                'newest products',
+                Product.objects.filter(is_active=True).order_by('-created_at', '-id')[:20],
+                ['product_active_created_idx'],
+            ),
+        ]
+        if product is not None:
+            queries += [
+                (
+                    'product keyset page',
+                    Product.objects.filter(
+                        Q(created_at__lt=product.created_at) | Q(created_at=product.created_at, id__lt=product.id),
+                        is_active=True
+                    ).order_by('-created_at', '-id')[:11],
+                    ['product_active_created_idx'],
+                ),
+                (
+                    'available colors',
+                    ProductColor.objects.filter(product_id=product.id, is_available=True).order_by('id'),
+                    ['color_available_idx'],
+                ),
+            ]
+        if user_id is not None:
+            queries.append((
+                'user orders',
+                Order.objects.filter(user_id=user_id).order_by('-created_at')[:20],
+                ['order_user_created_idx'],
+            ))
+        queries.append((
+            'staff orders',
+            Order.objects.order_by('-created_at')[:50],
+            ['order_created_idx'],
+        ))
+        return queries
+
+    @staticmethod
+    def existing_indexes():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()')
+            return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def measure(queryset, repeat, drop=()):
+        """Median execution time and the last plan, optionally with indexes dropped"""
+        timings = []
+        plan = []
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for index in drop:
+                        cursor.execute(f'DROP INDEX {connection.ops.quote_name(index)}')
+                for _ in range(repeat):
+                    output = queryset.explain(analyze=True, buffers=True)
+                    timings.append(float(EXECUTION_TIME.search(output).group(1)))
+                    plan = output.splitlines()
+                raise Rollback
+        except Rollback:
+            pass
+        return statistics.median(timings), plan
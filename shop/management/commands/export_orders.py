@@ -0,0 +1,44 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import iter_orders_csv, parse_export_filters
+
+
+class Command(BaseCommand):
+    help = 'Write orders and their items as CSV, streaming them from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write; standard output by default')
+        parser.add_argument('--date-from', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Last day to include (YYYY-MM-DD)')
+        parser.add_argument('--status', help='Comma separated statuses to include')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the cursor at a time')
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters({
+                'date_from': options['date_from'],
+                'date_to': options['date_to'],
+                'status': options['status'],
+            })
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        size = 0
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for piece in iter_orders_csv(filters, options['chunk_size']):
+                output.write(piece)
+                size += len(piece)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {size / 1024 / 1024:.1f} MB to {options['output']} in {elapsed:.1f}s"
+            ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog import rebuild_category_paths
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized path and depth of every category'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            changed, total = rebuild_category_paths(batch_size=options['batch_size'])
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {changed} of {total} categories'))
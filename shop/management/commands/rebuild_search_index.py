@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog import bump_catalog_version
+from shop.models import Product
+from shop.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Recompute the full-text search vectors of all products, e.g. after bulk imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        ids = Product.objects.order_by('id').values_list('id', flat=True)
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(ids.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            updated += update_search_vectors(Product.objects.filter(id__gte=batch[0], id__lte=batch[-1]))
+            last_id = batch[-1]
+            self.stdout.write(f'{updated} products indexed')
+
+        # Cached search results were computed from the old vectors
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search vectors for {updated} products'))
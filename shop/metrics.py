@@ -0,0 +1,247 @@
+import bisect
+import hmac
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.db import connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Histogram(Counter):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in values:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield f'{self.name}_bucket', labels + (('le', bound),), cumulative
+            yield f'{self.name}_bucket', labels + (('le', '+Inf'),), count
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_cache(self, name, cache):
+        """Export the hit/miss counters of an in-process cache (bot.utils.LRUCache) at scrape time"""
+        self._caches[name] = cache
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        if self._caches:
+            lines.append('# HELP local_cache_requests_total Lookups in in-process caches')
+            lines.append('# TYPE local_cache_requests_total counter')
+            for name, cache in self._caches.items():
+                lines.append(f'local_cache_requests_total{{cache="{name}",result="hit"}} {cache.hits}')
+                lines.append(f'local_cache_requests_total{{cache="{name}",result="miss"}} {cache.misses}')
+            lines.append('# HELP local_cache_entries Entries held by in-process caches')
+            lines.append('# TYPE local_cache_entries gauge')
+            for name, cache in self._caches.items():
+                lines.append(f'local_cache_entries{{cache="{name}"}} {len(cache)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CACHE_REQUESTS = REGISTRY.counter('cache_requests_total', 'Lookups in shared (Redis) caches', ['cache', 'result'])
+
+
+class QueryStats:
+    """connection.execute_wrapper that counts and times queries"""
+
+    __slots__ = ('count', 'elapsed')
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.count += 1
+
+
+class Observation:
+    __slots__ = ('error',)
+
+    def __init__(self):
+        self.error = False
+
+
+class WorkMetrics:
+    """Calls and errors of a kind of work, plus wall time and database use of a sample of calls"""
+
+    def __init__(self, prefix, description, labelnames):
+        self.calls = REGISTRY.counter(f'{prefix}_total', f'{description} handled', labelnames)
+        self.errors = REGISTRY.counter(f'{prefix}_errors_total', f'{description} that failed', labelnames)
+        self.duration = REGISTRY.histogram(
+            f'{prefix}_duration_seconds', f'Wall time of sampled {description.lower()}', labelnames
+        )
+        self.queries = REGISTRY.histogram(
+            f'{prefix}_db_queries', f'Database queries of sampled {description.lower()}', labelnames,
+            buckets=QUERY_BUCKETS
+        )
+        self.db_time = REGISTRY.counter(
+            f'{prefix}_db_seconds_total', f'Database time of sampled {description.lower()}', labelnames
+        )
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the call; time it and its queries only for METRICS_SAMPLE_RATE of calls"""
+        observation = Observation()
+        self.calls.inc(**labels)
+        sampled = random.random() < settings.METRICS_SAMPLE_RATE
+        stats = QueryStats() if sampled else None
+        started = time.perf_counter()
+        try:
+            if sampled:
+                with connection.execute_wrapper(stats):
+                    yield observation
+            else:
+                yield observation
+        except Exception:
+            observation.error = True
+            raise
+        finally:
+            if observation.error:
+                self.errors.inc(**labels)
+            if sampled:
+                self.duration.observe(time.perf_counter() - started, **labels)
+                self.queries.observe(stats.count, **labels)
+                self.db_time.inc(stats.elapsed, **labels)
+
+
+API_REQUESTS = WorkMetrics('api_requests', 'API requests', ['view', 'action'])
+
+
+class InstrumentedViewMixin:
+    """Record API_REQUESTS for every request a DRF viewset handles"""
+
+    def dispatch(self, request, *args, **kwargs):
+        action_map = getattr(self, 'action_map', None) or {}
+        action = action_map.get(request.method.lower(), request.method.lower())
+        with API_REQUESTS.track(view=type(self).__name__, action=action) as observation:
+            response = super().dispatch(request, *args, **kwargs)
+            observation.error = response.status_code >= 500
+        return response
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}'):
+            self.send_error(403)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, address='127.0.0.1'):
+    """Serve REGISTRY on a background thread, for processes without a Django HTTP server (the bot)
+
+    Listens on loopback unless another address is given. When METRICS_TOKEN is
+    set, scrapes must send it as a Bearer token, as for the /metrics view.
+    """
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving metrics on {address or '*'}:{port}")
+    return server
@@ -1,5 +1,10 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.utils.translation import gettext_lazy as _
 
 
@@ -20,14 +25,26 @@ class Category(models.Model):
     name_ru = models.CharField(max_length=200, verbose_name=_("Name (Russian)"))
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
     image = models.ImageField(upload_to='categories/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     order = models.PositiveIntegerField(default=0)
+    # Materialized path of ids from the root down to this category, e.g. "/1/5/12/"
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['order', 'name_uz']
         verbose_name = _("Category")
         verbose_name_plural = _("Categories")
+        indexes = [
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+            # Children (or roots) of a category in menu order
+            models.Index(
+                fields=['parent', 'order', 'name_uz'], condition=Q(is_active=True),
+                name='category_active_parent_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name_uz
@@ -37,12 +54,69 @@ class Category(models.Model):
 
     @property
     def level(self):
-        level = 0
-        parent = self.parent
-        while parent:
-            level += 1
-            parent = parent.parent
-        return level
+        return self.depth
+
+    def clean(self):
+        if self.pk and self.parent_id and self.pk in self._parent_ids():
+            raise ValidationError({'parent': _("A category cannot be moved under itself.")})
+
+    def _parent_ids(self):
+        """Ids from the parent up to the root, read from the parent's path
+
+        A path is empty until it has been computed (categories created before paths
+        existed); then the parents are followed one query at a time instead.
+        """
+        if not self.parent_id:
+            return []
+        if self.parent.path:
+            return [int(pk) for pk in reversed(self.parent.path.strip('/').split('/'))]
+        ids = []
+        node = self.parent
+        while node is not None and node.pk not in ids:
+            ids.append(node.pk)
+            node = node.parent
+        return ids
+
+    def save(self, *args, **kwargs):
+        old_path, old_depth = self.path, self.depth
+        parent_ids = self._parent_ids()
+        if self.pk in parent_ids:
+            raise ValueError(f"Category {self.pk} cannot be moved under itself")
+        prefix = '/' + ''.join(f'{pk}/' for pk in reversed(parent_ids))
+        self.depth = len(parent_ids)
+        if self.pk:
+            self.path = f'{prefix}{self.pk}/'
+
+        super().save(*args, **kwargs)
+
+        if not old_path or not self.path:
+            self.path = f'{prefix}{self.pk}/'
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        elif old_path != self.path:
+            # Moved: rewrite the path prefix and depth of the whole subtree
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+                depth=F('depth') + (self.depth - old_depth),
+            )
+
+    def get_ancestors(self):
+        ids = [int(pk) for pk in self.path.strip('/').split('/')[:-1]]
+        return Category.objects.filter(id__in=ids).order_by('depth')
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_subtree_products(self):
+        """Products attached to this category or any category below it"""
+        return Product.objects.filter(Exists(
+            Product.categories.through.objects.filter(
+                product_id=OuterRef('pk'),
+                category__path__startswith=self.path
+            )
+        ))
 
 
 class Product(models.Model):
@@ -52,7 +126,12 @@ class Product(models.Model):
     description_ru = models.TextField(blank=True, verbose_name=_("Description (Russian)"))
     categories = models.ManyToManyField(Category, related_name='products')
     main_image = models.ImageField(upload_to='products/', verbose_name=_("Main Image"))
+    main_image_file_id = models.CharField(max_length=255, blank=True, editable=False)
+    main_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
+    # Kept current by shop.search.update_search_vectors
+    search_vector_uz = SearchVectorField(null=True, editable=False)
+    search_vector_ru = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -60,6 +139,18 @@ class Product(models.Model):
         ordering = ['-created_at']
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
+        indexes = [
+            # Newest active products: API listing and keyset pagination in the bot
+            models.Index(
+                fields=['-created_at', '-id'], condition=Q(is_active=True),
+                name='product_active_created_idx'
+            ),
+            GinIndex(fields=['search_vector_uz'], name='product_search_uz_idx'),
+            GinIndex(fields=['search_vector_ru'], name='product_search_ru_idx'),
+            # Fuzzy name matching, needs the pg_trgm extension (created in pre_migrate)
+            GinIndex(OpClass('name_uz', name='gin_trgm_ops'), name='product_name_uz_trgm_idx'),
+            GinIndex(OpClass('name_ru', name='gin_trgm_ops'), name='product_name_ru_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name_uz
@@ -83,6 +174,13 @@ class ProductColor(models.Model):
     class Meta:
         verbose_name = _("Product Color")
         verbose_name_plural = _("Product Colors")
+        indexes = [
+            # Available colors of a product in id order
+            models.Index(fields=['product', 'id'], condition=Q(is_available=True), name='color_available_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=Q(price__gte=0), name='color_price_non_negative'),
+        ]
 
     def __str__(self):
         return f"{self.product.name_uz} - {self.name_uz}"
@@ -94,6 +192,8 @@ class ProductColor(models.Model):
 class ProductColorImage(models.Model):
     color = models.ForeignKey(ProductColor, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='product_colors/')
+    file_id = models.CharField(max_length=255, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -114,6 +214,9 @@ class Cart(models.Model):
         unique_together = ['user', 'product_color']
         verbose_name = _("Cart Item")
         verbose_name_plural = _("Cart Items")
+        constraints = [
+            models.CheckConstraint(check=Q(quantity__gte=1), name='cart_quantity_positive'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product_color}"
@@ -135,6 +238,8 @@ class Order(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Last status the customer was sent a notification about; empty until the first one
+    notified_status = models.CharField(max_length=20, choices=STATUS_CHOICES, blank=True, editable=False)
     total_amount = models.DecimalField(max_digits=14, decimal_places=2)
     phone_number = models.CharField(max_length=20)
     address = models.TextField(blank=True)
@@ -146,10 +251,31 @@ class Order(models.Model):
         ordering = ['-created_at']
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
+        indexes = [
+            # A user's orders, newest first
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Staff listing of all orders
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=Q(total_amount__gte=0), name='order_total_non_negative'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets post_save tell a status change from any other save without a query
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Set after post_save, whose receivers compare the new status with the loaded one
+        self._loaded_status = self.status
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -161,6 +287,10 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = _("Order Item")
         verbose_name_plural = _("Order Items")
+        constraints = [
+            models.CheckConstraint(check=Q(quantity__gte=1), name='order_item_quantity_positive'),
+            models.CheckConstraint(check=Q(price__gte=0), name='order_item_price_non_negative'),
+        ]
 
     def __str__(self):
         return f"{self.order} - {self.product_color}"
@@ -170,4 +300,115 @@ class OrderItem(models.Model):
         if self.price is not None and self.quantity is not None:
             total = self.price * self.quantity
             return total
-        return 'None Type'
\ No newline at end of file
+        return 'None Type'
+
+class Broadcast(models.Model):
+    STATUS_CHOICES = [
+        ('draft', _('Draft')),
+        ('running', _('Running')),
+        ('paused', _('Paused')),
+        ('done', _('Done')),
+        ('failed', _('Failed')),
+    ]
+
+    text_uz = models.TextField(verbose_name=_("Text (Uzbek)"))
+    text_ru = models.TextField(verbose_name=_("Text (Russian)"))
+    image = models.ImageField(upload_to='broadcasts/', null=True, blank=True)
+    image_file_id = models.CharField(max_length=255, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft', editable=False)
+    # Every recipient with an id up to last_user_id has been handled
+    last_user_id = models.BigIntegerField(default=0, editable=False)
+    sent_count = models.PositiveIntegerField(default=0, editable=False)
+    failed_count = models.PositiveIntegerField(default=0, editable=False)
+    blocked_count = models.PositiveIntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    finished_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Why the last run stopped, when status is failed
+    error = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _("Broadcast")
+        verbose_name_plural = _("Broadcasts")
+
+    def __str__(self):
+        return f"Broadcast #{self.id} ({self.get_status_display()})"
+
+    def clean(self):
+        # Telegram limits a photo caption to 1024 characters and a message to 4096
+        limit = 1024 if self.image else 4096
+        errors = {
+            f'text_{language}': _("At most %(limit)d characters") % {'limit': limit}
+            for language in ('uz', 'ru')
+            if len(getattr(self, f'text_{language}')) > limit
+        }
+        if errors:
+            raise ValidationError(errors)
+
+    def get_text(self, language='uz'):
+        return getattr(self, f'text_{language}', self.text_uz)
+
+
+# Daily rollups kept by shop.analytics: created_at days in TIME_ZONE, counters only ever
+# incremented or decremented, so dashboards read O(days) rows instead of every order
+
+class DailyOrderStats(models.Model):
+    """Orders created on a day by their current status"""
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _("Daily Order Stats")
+        verbose_name_plural = _("Daily Order Stats")
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='daily_order_stats_unique'),
+        ]
+
+
+class DailyProductSales(models.Model):
+    """Units of a product color sold on a day, counting orders that are not cancelled"""
+    day = models.DateField()
+    product_color = models.ForeignKey(ProductColor, on_delete=models.CASCADE, related_name='+')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _("Daily Product Sales")
+        verbose_name_plural = _("Daily Product Sales")
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product_color'], name='daily_product_sales_unique'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    """Units sold on a day of products directly in a category, counting orders that are not cancelled"""
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _("Daily Category Sales")
+        verbose_name_plural = _("Daily Category Sales")
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_unique'),
+        ]
+
+
+class DailyNewUsers(models.Model):
+    """Users who joined on a day by the language they had then"""
+    day = models.DateField()
+    language = models.CharField(max_length=2)
+    users = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Daily New Users")
+        verbose_name_plural = _("Daily New Users")
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'language'], name='daily_new_users_unique'),
+        ]
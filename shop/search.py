@@ -0,0 +1,110 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.core.cache import cache
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce
+import logging
+
+from .catalog import get_catalog_version
+from .metrics import CACHE_REQUESTS
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Postgres text search configuration per language; there is no Uzbek stemmer
+SEARCH_CONFIGS = {
+    'uz': 'simple',
+    'ru': 'russian',
+}
+
+CACHE_KEY = 'search:{version}:{digest}'
+MAX_TERM_LENGTH = 100
+
+
+def search_vector(language):
+    config = SEARCH_CONFIGS[language]
+    return (
+        SearchVector(f'name_{language}', weight='A', config=config)
+        + SearchVector(f'description_{language}', weight='B', config=config)
+    )
+
+
+def update_search_vectors(queryset):
+    """Recompute the stored search vectors of the given products in one UPDATE"""
+    return queryset.update(**{
+        f'search_vector_{language}': search_vector(language) for language in SEARCH_CONFIGS
+    })
+
+
+def normalize_term(term):
+    return ' '.join(term.split()).lower()[:MAX_TERM_LENGTH]
+
+
+def rank_products(term, queryset=None):
+    """Products matching term in either language, best match first
+
+    Full-text matches on the stored vectors are ranked by ts_rank; trigram word
+    similarity on the names catches typos and partially typed words.
+    """
+    if queryset is None:
+        queryset = Product.objects.filter(is_active=True)
+
+    match = Q()
+    rank = Value(0.0)
+    for language, config in SEARCH_CONFIGS.items():
+        query = SearchQuery(term, config=config, search_type='websearch')
+        match |= Q(**{f'search_vector_{language}': query})
+        match |= Q(**{f'name_{language}__trigram_word_similar': term})
+        rank = rank + Coalesce(SearchRank(F(f'search_vector_{language}'), query), 0.0, output_field=FloatField())
+        rank = rank + TrigramWordSimilarity(term, f'name_{language}')
+
+    return queryset.filter(match).annotate(search_rank=rank).order_by('-search_rank', '-created_at', '-id')
+
+
+def search_product_ids(term, limit=None, category_id=None):
+    """Ranked ids of active products matching term, optionally within a category
+
+    The category is applied in the ranking query, so the limit counts matches
+    inside it. Results are cached until the catalog version changes, so repeated
+    (hot) terms skip the ranking query entirely.
+    """
+    term = normalize_term(term)
+    if not term:
+        return []
+    limit = limit or settings.SEARCH_RESULTS_LIMIT
+
+    version = get_catalog_version()
+    digest = hashlib.sha1(f"{limit}:{category_id or ''}:{term}".encode()).hexdigest()
+    key = CACHE_KEY.format(version=version, digest=digest)
+    if version is not None:
+        try:
+            ids = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {str(e)}")
+            ids = None
+        CACHE_REQUESTS.inc(cache='search', result='miss' if ids is None else 'hit')
+        if ids is not None:
+            return ids
+
+    queryset = Product.objects.filter(is_active=True)
+    if category_id:
+        queryset = queryset.filter(categories__id=category_id)
+    ids = list(rank_products(term, queryset).values_list('id', flat=True)[:limit])
+
+    if version is not None:
+        try:
+            cache.set(key, ids, settings.SEARCH_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {str(e)}")
+    return ids
+
+
+def order_by_ids(queryset, ids):
+    """Restrict queryset to ids, keeping their order"""
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).order_by(
+        Case(*[When(id=pk, then=Value(position)) for position, pk in enumerate(ids)])
+    )
@@ -1,7 +1,33 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from .imaging import pick_variant
 from .models import User, Category, Product, ProductColor, ProductColorImage, Cart, Order, OrderItem
 
 
+class ImageVariantsMixin:
+    """Serve the smallest resized variant covering the ?image_size= query parameter
+
+    Without the parameter the largest variant is served; the original upload is
+    only used until its variants have been built.
+    """
+    image_variant_fields = {}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        try:
+            size = int(request.query_params.get('image_size', 0)) if request else 0
+        except ValueError:
+            size = 0
+
+        for image_field, variants_field in self.image_variant_fields.items():
+            variant = pick_variant(getattr(instance, variants_field), size)
+            if variant and data.get(image_field):
+                url = default_storage.url(variant['name'])
+                data[image_field] = request.build_absolute_uri(url) if request else url
+        return data
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -9,21 +35,25 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(ImageVariantsMixin, serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
     level = serializers.ReadOnlyField()
+    image_variant_fields = {'image': 'image_variants'}
 
     class Meta:
         model = Category
         fields = ['id', 'name_uz', 'name_ru', 'parent', 'image', 'is_active', 'order', 'level', 'children', 'created_at']
 
     def get_children(self, obj):
-        if obj.children.exists():
-            return CategorySerializer(obj.children.filter(is_active=True), many=True).data
-        return []
+        children = getattr(obj, 'active_children', None)
+        if children is None:
+            children = obj.children.filter(is_active=True)
+        return CategorySerializer(children, many=True, context=self.context).data
+
 
+class ProductColorImageSerializer(ImageVariantsMixin, serializers.ModelSerializer):
+    image_variant_fields = {'image': 'image_variants'}
 
-class ProductColorImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductColorImage
         fields = ['id', 'image', 'order']
@@ -35,11 +65,13 @@ class ProductColorSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductColor
         fields = ['id', 'name_uz', 'name_ru', 'hex_code', 'price', 'is_available', 'images']
+        extra_kwargs = {'price': {'min_value': 0}}
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     colors = ProductColorSerializer(many=True, read_only=True)
     categories = CategorySerializer(many=True, read_only=True)
+    image_variant_fields = {'main_image': 'main_image_variants'}
 
     class Meta:
         model = Product
@@ -54,6 +86,7 @@ class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = ['id', 'product_color', 'quantity', 'total_price', 'created_at']
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
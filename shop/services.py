@@ -0,0 +1,98 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+import logging
+
+from .models import Cart, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+CartSummary = namedtuple('CartSummary', ['items', 'total'])
+
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('product_color__price'),
+    output_field=DecimalField(max_digits=14, decimal_places=2)
+)
+
+ORDER_IDEMPOTENCY_KEY = 'order:placed:{key}'
+ORDER_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+
+def cart_queryset(user_id):
+    """Cart rows with color and product joined in, and line/grand totals computed in SQL"""
+    return (
+        Cart.objects.filter(user_id=user_id)
+        .select_related('product_color__product')
+        .annotate(
+            line_total=LINE_TOTAL,
+            cart_total=Window(
+                expression=Sum(LINE_TOTAL),
+                output_field=DecimalField(max_digits=14, decimal_places=2)
+            ),
+        )
+        .order_by('created_at', 'id')
+    )
+
+
+def build_cart_summary(user_id):
+    """Load a user's cart in one query"""
+    items = list(cart_queryset(user_id))
+    total = items[0].cart_total if items else Decimal('0')
+    return CartSummary(items, total)
+
+
+def remember_order(cache_key, order_id):
+    try:
+        cache.set(cache_key, order_id, ORDER_IDEMPOTENCY_TTL)
+    except Exception as e:
+        logger.warning(f"Order idempotency cache unavailable: {str(e)}")
+
+
+def place_order(user_id, phone_number='', idempotency_key=None):
+    """Turn a user's cart into a pending order in one transaction
+
+    Runs a constant number of queries whatever the cart size. Returns the order,
+    or None when the cart is empty. A repeated idempotency_key returns the order
+    created the first time instead of placing another one; while the cache is
+    unavailable the key is ignored rather than failing the order.
+    """
+    cache_key = ORDER_IDEMPOTENCY_KEY.format(key=idempotency_key) if idempotency_key else None
+    if cache_key:
+        try:
+            order_id = cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"Order idempotency cache unavailable: {str(e)}")
+            order_id = None
+        if order_id is not None:
+            return Order.objects.filter(id=order_id).first()
+
+    with transaction.atomic():
+        rows = list(
+            Cart.objects.select_for_update(of=('self',))
+            .filter(user_id=user_id)
+            .annotate(price=F('product_color__price'), line_total=LINE_TOTAL)
+            .values_list('id', 'product_color_id', 'quantity', 'price', 'line_total')
+        )
+        if not rows:
+            return None
+
+        order = Order.objects.create(
+            user_id=user_id,
+            total_amount=sum(row[4] for row in rows),
+            phone_number=phone_number or '',
+            status='pending'
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_color_id=product_color_id, quantity=quantity, price=price)
+            for cart_id, product_color_id, quantity, price, line_total in rows
+        ])
+        Cart.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+        if cache_key:
+            transaction.on_commit(lambda: remember_order(cache_key, order.id))
+
+    logger.info(f"Order #{order.id} placed for user {user_id}: {len(rows)} items, total {order.total_amount}")
+    return order
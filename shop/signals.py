@@ -0,0 +1,110 @@
+from django.db import connections, transaction
+from django.db.models.signals import pre_migrate, post_migrate, pre_save, pre_delete, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+import logging
+
+from . import analytics
+from .catalog import bump_catalog_version, rebuild_category_paths
+from .imaging import IMAGE_FIELDS, schedule_variants
+from .models import Broadcast, Category, Order, Product, ProductColor, ProductColorImage, User
+from .search import update_search_vectors
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_migrate)
+def create_search_extensions(sender, using, **kwargs):
+    """The trigram indexes on Product need pg_trgm before shop's tables are created"""
+    if sender.name != 'shop' or connections[using].vendor != 'postgresql':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(post_migrate)
+def fill_category_paths(sender, using, **kwargs):
+    """Compute the paths of categories that were created before paths were stored"""
+    if sender.name != 'shop' or not Category.objects.using(using).filter(path='').exists():
+        return
+    try:
+        rebuild_category_paths(using=using)
+    except ValueError as e:
+        logger.error(f"Could not fill category paths: {str(e)}")
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductColor)
+@receiver(post_delete, sender=ProductColor)
+@receiver(post_save, sender=ProductColorImage)
+@receiver(post_delete, sender=ProductColorImage)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def product_search_changed(sender, instance, update_fields=None, **kwargs):
+    fields = {'name_uz', 'name_ru', 'description_uz', 'description_ru'}
+    if update_fields is None or fields & set(update_fields):
+        update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductColorImage)
+@receiver(pre_save, sender=Broadcast)
+def forget_derived_images(sender, instance, **kwargs):
+    """Drop the cached Telegram file_id and resized variants when the image is replaced"""
+    image_field, file_id_field, variants_field = IMAGE_FIELDS[sender._meta.label]
+    if not instance.pk:
+        return
+    old_name = sender.objects.filter(pk=instance.pk).values_list(image_field, flat=True).first()
+    if old_name != getattr(instance, image_field).name:
+        if file_id_field:
+            setattr(instance, file_id_field, '')
+        setattr(instance, variants_field, {})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductColorImage)
+@receiver(post_save, sender=Broadcast)
+def build_derived_images(sender, instance, **kwargs):
+    image_field, file_id_field, variants_field = IMAGE_FIELDS[sender._meta.label]
+    if getattr(instance, image_field) and not getattr(instance, variants_field):
+        label, pk = sender._meta.label, instance.pk
+        transaction.on_commit(lambda: schedule_variants(label, pk))
+
+
+@receiver(post_save, sender=Order)
+def order_analytics(sender, instance, created, **kwargs):
+    """Keep the daily rollups current once the order change commits"""
+    if created:
+        order_id, status = instance.pk, instance.status
+        transaction.on_commit(lambda: analytics.record_order_created(order_id, status))
+        return
+    previous = instance.__dict__.get('_loaded_status')
+    if previous is not None and previous != instance.status:
+        status = instance.status
+        transaction.on_commit(lambda: analytics.record_status_change(instance, previous, status))
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted_analytics(sender, instance, **kwargs):
+    # The items are still there before the delete; the deltas are applied once it commits
+    deltas = analytics.order_deltas(instance, instance.__dict__.get('_loaded_status') or instance.status, sign=-1)
+    transaction.on_commit(lambda: analytics.apply(deltas))
+
+
+@receiver(post_save, sender=User)
+def user_joined_analytics(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: analytics.record_user_joined(instance))
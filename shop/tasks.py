@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .imaging import generate_variants
+
+
+@shared_task(ignore_result=True)
+def generate_image_variants(model_label, pk):
+    generate_variants(model_label, pk)
@@ -0,0 +1,325 @@
+import csv
+import io
+from decimal import Decimal
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APITestCase
+
+from . import admin, catalog
+from .admin import EstimatedCountPaginator
+from .exports import iter_orders_csv
+from .models import Cart, Category, Order, OrderItem, Product, ProductColor, ProductColorImage, User
+from .services import build_cart_summary, cart_queryset, place_order
+
+
+def create_catalog(products=3, colors=3):
+    """Products in one category, each with colors priced 10000, 20000, ..."""
+    category = Category.objects.create(name_uz='Kiyim', name_ru='Одежда')
+    created = []
+    for i in range(products):
+        product = Product.objects.create(name_uz=f'Mahsulot {i}', name_ru=f'Товар {i}', main_image='products/item.jpg')
+        product.categories.add(category)
+        created.extend(
+            ProductColor.objects.create(
+                product=product, name_uz=f'Rang {j}', name_ru=f'Цвет {j}', price=Decimal('10000') * (j + 1)
+            )
+            for j in range(colors)
+        )
+    return created
+
+
+def place_order_for(user, colors):
+    Cart.objects.bulk_create([Cart(user=user, product_color=color, quantity=1) for color in colors[:3]])
+    return place_order(user.id)
+
+
+class CartQueryCountTests(TestCase):
+    """Cart rendering and checkout take the same queries for one cart line or many"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.colors = create_catalog()
+        cls.user = User.objects.create(username='customer', telegram_id=700000101, phone_number='+998901234567')
+
+    def fill_cart(self, lines):
+        Cart.objects.bulk_create([
+            Cart(user=self.user, product_color=color, quantity=2) for color in self.colors[:lines]
+        ])
+
+    def test_cart_summary(self):
+        for lines in (1, len(self.colors)):
+            Cart.objects.all().delete()
+            self.fill_cart(lines)
+            with self.assertNumQueries(1):
+                summary = build_cart_summary(self.user.id)
+                # Everything the bot and CartSerializer read is already loaded
+                for item in summary.items:
+                    item.product_color.product.get_name('uz')
+                    item.line_total
+            self.assertEqual(len(summary.items), lines)
+            self.assertEqual(summary.total, sum(color.price * 2 for color in self.colors[:lines]))
+
+    def test_cart_queryset(self):
+        self.fill_cart(len(self.colors))
+        with self.assertNumQueries(1):
+            items = list(cart_queryset(self.user.id))
+            self.assertEqual({item.cart_total for item in items}, {sum(item.line_total for item in items)})
+
+    def test_place_order(self):
+        for lines in (1, len(self.colors)):
+            self.fill_cart(lines)
+            # Savepoint, cart read, order and item inserts, cart delete, release
+            with self.assertNumQueries(6):
+                order = place_order(self.user.id, phone_number=self.user.phone_number)
+            self.assertEqual(OrderItem.objects.filter(order=order).count(), lines)
+            self.assertEqual(order.total_amount, sum(color.price * 2 for color in self.colors[:lines]))
+            self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_place_order_empty_cart(self):
+        with self.assertNumQueries(3):
+            self.assertIsNone(place_order(self.user.id))
+        self.assertFalse(Order.objects.exists())
+
+
+class PlaceOrderTests(TestCase):
+    """Checkout with an idempotency key, with and without the cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.colors = create_catalog()
+        cls.user = User.objects.create(username='customer', telegram_id=700000102)
+
+    def setUp(self):
+        cache.clear()
+
+    def fill_cart(self, lines):
+        Cart.objects.bulk_create([Cart(user=self.user, product_color=color, quantity=1) for color in self.colors[:lines]])
+
+    def test_repeated_key_returns_the_first_order(self):
+        self.fill_cart(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.user.id, idempotency_key='update-1')
+        self.fill_cart(1)
+        self.assertEqual(place_order(self.user.id, idempotency_key='update-1'), order)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cache_unavailable(self):
+        # A cache outage drops idempotency instead of failing the checkout
+        self.fill_cart(1)
+        with mock.patch('shop.services.cache') as broken:
+            broken.get.side_effect = broken.set.side_effect = ConnectionError('cache down')
+            with self.captureOnCommitCallbacks(execute=True):
+                order = place_order(self.user.id, idempotency_key='update-2')
+        self.assertIsNotNone(order)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+
+class AdminQueryCountTests(TestCase):
+    """Admin changelists take the same queries for a few rows or a full page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.colors = create_catalog(products=5, colors=4)
+
+    def setUp(self):
+        admin._estimates.clear()
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = User.objects.count()
+        users = User.objects.bulk_create([
+            User(username=f'customer{start + i}', telegram_id=700000200 + start + i) for i in range(count)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=user, product_color=self.colors[i % len(self.colors)], quantity=1) for i, user in enumerate(users)
+        ])
+        Order.objects.bulk_create([
+            Order(user=user, status='pending' if i % 2 else 'confirmed', total_amount=Decimal('10000'), phone_number='+998')
+            for i, user in enumerate(users)
+        ])
+
+    def assertChangelistQueries(self, url, queries):
+        # The first request of a process reads the table size estimate on PostgreSQL
+        self.assertEqual(self.client.get(url).status_code, 200)
+        for count in (2, 20):
+            self.add_rows(count)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_order_changelist(self):
+        self.assertChangelistQueries(reverse('admin:shop_order_changelist'), 6)
+
+    def test_order_changelist_filtered(self):
+        # Filtered lists are counted exactly, once
+        self.assertChangelistQueries(reverse('admin:shop_order_changelist') + '?status__exact=pending', 6)
+
+    def test_cart_changelist(self):
+        self.assertChangelistQueries(reverse('admin:shop_cart_changelist'), 4)
+
+    def test_product_changelist(self):
+        self.assertChangelistQueries(reverse('admin:shop_product_changelist'), 5)
+
+    def test_user_changelist(self):
+        self.assertChangelistQueries(reverse('admin:shop_user_changelist'), 4)
+
+    def test_order_change_form(self):
+        order = place_order_for(User.objects.create(username='buyer', telegram_id=700000199), self.colors)
+        with self.assertNumQueries(21):
+            response = self.client.get(reverse('admin:shop_order_change', args=[order.pk]))
+        self.assertEqual(response.status_code, 200)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """Unfiltered tables of at least threshold rows take their size from pg_class.reltuples"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([User(username=f'customer{i}', telegram_id=700000300 + i) for i in range(30)])
+
+    def setUp(self):
+        admin._estimates.clear()
+
+    def test_counts_filtered_lists_exactly(self):
+        paginator = EstimatedCountPaginator(User.objects.filter(username__startswith='customer1').order_by('id'), 10)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 11)
+
+    @skipUnless(connection.vendor == 'postgresql', 'reltuples is PostgreSQL planner statistics')
+    def test_small_table_is_counted_exactly(self):
+        self.analyze()
+        paginator = EstimatedCountPaginator(User.objects.order_by('id'), 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 30)
+        # Below the threshold the estimate is read, then COUNT(*) runs
+        self.assertEqual(len(queries), 2)
+        self.assertIn('COUNT(', queries[1]['sql'])
+
+        # The estimate is reused: later pages only count
+        paginator = EstimatedCountPaginator(User.objects.order_by('id'), 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 30)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('COUNT(', queries[0]['sql'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'reltuples is PostgreSQL planner statistics')
+    def test_large_table_uses_the_estimate(self):
+        self.analyze()
+        paginator = EstimatedCountPaginator(User.objects.order_by('id'), 10)
+        paginator.threshold = 1
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 30)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('reltuples', queries[0]['sql'])
+
+    @staticmethod
+    def analyze():
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(User._meta.db_table)}')
+
+
+class CatalogApiQueryCountTests(APITestCase):
+    """Product and category endpoints take the same queries for a small page or a large one"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='customer', telegram_id=700000401)
+        cls.root = Category.objects.create(name_uz='Kiyim', name_ru='Одежда')
+        cls.leaves = [
+            Category.objects.create(name_uz=f"Bo‘lim {i}", name_ru=f'Раздел {i}', parent=cls.root) for i in range(3)
+        ]
+        # More descendants than a page holds, so a page always needs the missing ones loaded
+        Category.objects.bulk_create([
+            Category(name_uz=f'Ichki {i}', name_ru=f'Подраздел {i}', parent=cls.leaves[0], order=1) for i in range(30)
+        ])
+        catalog.rebuild_category_paths()
+        for i in range(30):
+            product = Product.objects.create(
+                name_uz=f"Ko‘ylak {i}", name_ru=f'Рубашка {i}', main_image='products/shirt.jpg'
+            )
+            product.categories.add(cls.leaves[i % 2], cls.root)
+            for j in range(3):
+                color = ProductColor.objects.create(
+                    product=product, name_uz=f'Rang {j}', name_ru=f'Цвет {j}', price=Decimal('10000') * (j + 1)
+                )
+                ProductColorImage.objects.bulk_create([
+                    ProductColorImage(color=color, image='product_colors/shirt.jpg', order=k) for k in range(2)
+                ])
+        cls.product = product
+
+    def setUp(self):
+        cache.clear()
+        catalog._tree = None
+        self.client.force_authenticate(self.user)
+        # A warm process: the category tree is built
+        catalog.get_category_tree()
+
+    def assertPageQueries(self, url, queries, rows):
+        for page_size in (5, 20):
+            cache.clear()
+            catalog.get_category_tree()
+            with mock.patch.object(PageNumberPagination, 'page_size', page_size):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), min(page_size, rows))
+
+    def test_product_list(self):
+        # Count, page, prefetched categories, colors and color images, then the categories' descendants
+        self.assertPageQueries('/api/products/', 6, 30)
+
+    def test_product_list_in_category(self):
+        self.assertPageQueries(f'/api/products/?category={self.leaves[0].id}', 6, 15)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Product search is PostgreSQL full-text search')
+    def test_product_search(self):
+        # The ranking query comes first; its ids are cached per catalog version
+        self.assertPageQueries(f"/api/products/?{urlencode({'search': 'рубашка'})}", 7, 30)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Product search is PostgreSQL full-text search')
+    def test_product_search_in_category(self):
+        # The limit applies to matches in the category, not to the catalog-wide ranking
+        with self.settings(SEARCH_RESULTS_LIMIT=20):
+            response = self.client.get('/api/products/', {'search': 'рубашка', 'category': self.leaves[1].id})
+        self.assertEqual(response.data['count'], 15)
+
+    def test_product_detail(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['colors']), 3)
+
+    def test_category_list(self):
+        # Nested children come from the tree snapshot plus one query for the descendants
+        self.assertPageQueries('/api/categories/', 3, 34)
+
+    def test_category_list_of_parent(self):
+        self.assertPageQueries(f'/api/categories/?parent={self.root.id}', 3, 3)
+
+    def test_category_detail(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/categories/{self.root.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['children']), 3)
+
+
+class OrderExportTests(TestCase):
+    def test_formulas_are_escaped(self):
+        colors = create_catalog(products=1, colors=1)
+        user = User.objects.create(username='=HYPERLINK("http://example.com")', telegram_id=700000501)
+        order = place_order_for(user, colors)
+        Order.objects.filter(pk=order.pk).update(phone_number='+998901234567', address='@SUM(A1:A9)')
+
+        header, row = csv.reader(io.StringIO(''.join(iter_orders_csv({})).lstrip('\ufeff')))
+        row = dict(zip(header, row))
+        self.assertEqual(row['username'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(row['address'], "'@SUM(A1:A9)")
+        self.assertEqual(row['phone_number'], '+998901234567')
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet
+from .views import UserViewSet, CategoryViewSet, ProductViewSet, CartViewSet, OrderViewSet, AnalyticsViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -8,6 +8,7 @@ router.register(r'categories', CategoryViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
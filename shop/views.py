@@ -1,15 +1,26 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from django.db.models import Q
-from .models import User, Category, Product, ProductColor, Cart, Order
+from django.db.models import Prefetch, prefetch_related_objects
+from . import analytics
+from .catalog import attach_category_relations
+from .exports import iter_orders_csv, parse_export_filters
+from .metrics import CONTENT_TYPE, REGISTRY, InstrumentedViewMixin
+from .models import User, Category, Product, ProductColor, ProductColorImage, Cart, Order
 from .serializers import (
     UserSerializer, CategorySerializer, ProductSerializer, 
     ProductColorSerializer, CartSerializer, OrderSerializer
 )
+from .search import order_by_ids, search_product_ids
+from .services import build_cart_summary, cart_queryset
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
@@ -28,7 +39,7 @@ class UserViewSet(viewsets.ModelViewSet):
         user.save()
         return Response({'status': 'success', 'is_active': user.is_active_bot})
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
@@ -42,13 +53,26 @@ class CategoryViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(parent__isnull=True)
         return queryset.order_by('order', 'name_uz')
 
-class ProductViewSet(viewsets.ModelViewSet):
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method == 'GET':
+            attach_category_relations(args[0] if kwargs.get('many') else [args[0]])
+        return super().get_serializer(*args, **kwargs)
+
+class ProductViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+        queryset = Product.objects.filter(is_active=True).prefetch_related(
+            'categories',
+            Prefetch(
+                'colors',
+                queryset=ProductColor.objects.filter(is_available=True).order_by('id').prefetch_related(
+                    Prefetch('images', queryset=ProductColorImage.objects.order_by('order', 'id'))
+                )
+            ),
+        )
         category_id = self.request.query_params.get('category')
         search = self.request.query_params.get('search')
         
@@ -56,21 +80,22 @@ class ProductViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(categories__id=category_id)
         
         if search:
-            queryset = queryset.filter(
-                Q(name_uz__icontains=search) | 
-                Q(name_ru__icontains=search) |
-                Q(description_uz__icontains=search) |
-                Q(description_ru__icontains=search)
-            )
+            return order_by_ids(queryset, search_product_ids(search, category_id=category_id))
         
-        return queryset.distinct().order_by('-created_at')
+        return queryset.order_by('-created_at')
 
-class CartViewSet(viewsets.ModelViewSet):
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method == 'GET':
+            products = args[0] if kwargs.get('many') else [args[0]]
+            attach_category_relations(category for product in products for category in product.categories.all())
+        return super().get_serializer(*args, **kwargs)
+
+class CartViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return cart_queryset(self.request.user.id).prefetch_related('product_color__images')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -79,6 +104,8 @@ class CartViewSet(viewsets.ModelViewSet):
     def add_item(self, request):
         product_color_id = request.data.get('product_color_id')
         quantity = int(request.data.get('quantity', 1))
+        if quantity < 1:
+            return Response({'error': 'Quantity must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             product_color = ProductColor.objects.get(id=product_color_id, is_available=True)
@@ -98,12 +125,19 @@ class CartViewSet(viewsets.ModelViewSet):
         except ProductColor.DoesNotExist:
             return Response({'error': 'Product color not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        summary = build_cart_summary(request.user.id)
+        prefetch_related_objects(summary.items, 'product_color__images')
+        serializer = self.get_serializer(summary.items, many=True)
+        return Response({'items': serializer.data, 'total': summary.total})
+
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         Cart.objects.filter(user=request.user).delete()
         return Response({'status': 'success'})
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
@@ -129,3 +163,82 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'status': 'success', 'new_status': new_status})
         
         return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """All orders and their items as CSV, streamed; filters: date_from, date_to, status"""
+        if not request.user.is_staff:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            filters = parse_export_filters(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(iter_orders_csv(filters), content_type='text/csv; charset=utf-8')
+        filename = f"orders_{timezone.localdate():%Y%m%d}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AnalyticsViewSet(InstrumentedViewMixin, viewsets.ViewSet):
+    """Sales dashboards read from the daily rollups; filters: date_from, date_to (the last 30 days by default)"""
+    permission_classes = [IsAdminUser]
+
+    def day_range(self, request):
+        first, last = analytics.parse_day_range(request.query_params)
+        return first, last, {'date_from': first, 'date_to': last}
+
+    def limit(self, request):
+        try:
+            return min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            raise ValueError('limit must be a number')
+
+    @action(detail=False, methods=['get'])
+    def orders(self, request):
+        try:
+            first, last, period = self.day_range(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        days, total = analytics.order_summary(first, last)
+        return Response({**period, 'days': days, 'total': total})
+
+    @action(detail=False, methods=['get'])
+    def products(self, request):
+        """Top sellers by units; by=color ranks product colors instead of products"""
+        by = request.query_params.get('by', 'product')
+        try:
+            first, last, period = self.day_range(request)
+            if by not in ('product', 'color'):
+                raise ValueError('by must be product or color')
+            results = analytics.top_products(first, last, self.limit(request), by)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**period, 'by': by, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        try:
+            first, last, period = self.day_range(request)
+            results = analytics.top_categories(first, last, self.limit(request))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**period, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def users(self, request):
+        try:
+            first, last, period = self.day_range(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**period, 'days': analytics.new_users(first, last)})
+
+
+def metrics(request):
+    """Metrics of this process in the Prometheus text format, for METRICS_TOKEN holders and staff"""
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
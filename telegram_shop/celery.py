@@ -0,0 +1,9 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telegram_shop.settings')
+
+app = Celery('telegram_shop')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -16,6 +16,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'shop',
@@ -63,6 +64,9 @@ DATABASES = {
         'PASSWORD': config('POSTGRES_PASSWORD', default='postgres'),
         'HOST': config('POSTGRES_HOST', default='db'),
         'PORT': config('POSTGRES_PORT', default='5432'),
+        # Persistent connections, one per thread: the bot holds at most BOT_WORKERS + 1
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -88,6 +92,25 @@ CACHES = {
     }
 }
 
+# Bot user cache: an in-process LRU in front of the Redis cache above.
+# Writes from other processes become visible locally after BOT_USER_CACHE_LOCAL_TTL.
+BOT_USER_CACHE_SIZE = config('BOT_USER_CACHE_SIZE', default=10000, cast=int)
+BOT_USER_CACHE_LOCAL_TTL = config('BOT_USER_CACHE_LOCAL_TTL', default=30, cast=int)
+BOT_USER_CACHE_TTL = config('BOT_USER_CACHE_TTL', default=3600, cast=int)
+
+# Category tree snapshot: seconds between checks of the shared catalog version key
+CATALOG_VERSION_CHECK_INTERVAL = config('CATALOG_VERSION_CHECK_INTERVAL', default=1, cast=float)
+
+# Product search: ranked ids of a term are cached per catalog version
+SEARCH_RESULTS_LIMIT = config('SEARCH_RESULTS_LIMIT', default=100, cast=int)
+SEARCH_CACHE_TTL = config('SEARCH_CACHE_TTL', default=600, cast=int)
+
+# Metrics: share of handler calls and API requests timed with their queries
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=0.1, cast=float)
+# /metrics answers staff sessions and, when set, "Authorization: Bearer <token>"; the bot's
+# --metrics-port servers require the token too when it is set
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 # Internationalization
 LANGUAGE_CODE = 'uz'
 TIME_ZONE = 'Asia/Tashkent'
@@ -131,9 +154,48 @@ CORS_ALLOWED_ORIGINS = [
 
 # Telegram Bot
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default='8149179778:AAFC2tlM92FfZGMFFe0KwiZ9kRcbSuDalSc')
+BOT_WORKERS = config('BOT_WORKERS', default=8, cast=int)
+
+# Product browsing: page size and whether a category lists products of its whole subtree
+BOT_PRODUCTS_PAGE_SIZE = config('BOT_PRODUCTS_PAGE_SIZE', default=10, cast=int)
+BOT_BROWSE_SUBTREE = config('BOT_BROWSE_SUBTREE', default=False, cast=bool)
+
+# Inline mode (enable it with /setinline in @BotFather): seconds Telegram may cache an answer
+BOT_INLINE_CACHE_TIME = config('BOT_INLINE_CACHE_TIME', default=300, cast=int)
+
+# context.user_data kept in Redis: written behind every BOT_PERSISTENCE_FLUSH_INTERVAL seconds,
+# dropped after BOT_PERSISTENCE_TTL seconds without activity
+BOT_PERSISTENCE = config('BOT_PERSISTENCE', default=True, cast=bool)
+BOT_PERSISTENCE_TTL = config('BOT_PERSISTENCE_TTL', default=30 * 24 * 3600, cast=int)
+BOT_PERSISTENCE_FLUSH_INTERVAL = config('BOT_PERSISTENCE_FLUSH_INTERVAL', default=1.0, cast=float)
+
+# Outgoing messages not answering an update (send_notifications): token buckets shared by
+# every sender, messages per second for the whole bot and per chat
+BOT_SEND_RATE = config('BOT_SEND_RATE', default=25, cast=float)
+BOT_SEND_CHAT_RATE = config('BOT_SEND_CHAT_RATE', default=1, cast=float)
+# Order status notifications: changes within BOT_NOTIFY_DELAY seconds become one message;
+# failed sends are retried after BOT_NOTIFY_BACKOFF * 2^n seconds
+BOT_NOTIFY_DELAY = config('BOT_NOTIFY_DELAY', default=10, cast=float)
+BOT_NOTIFY_BACKOFF = config('BOT_NOTIFY_BACKOFF', default=5, cast=float)
+BOT_NOTIFY_MAX_ATTEMPTS = config('BOT_NOTIFY_MAX_ATTEMPTS', default=5, cast=int)
+
+# Webhook mode: bot/webhook/ queues updates in Redis, consume_updates dispatches them.
+# Updates are sharded by user so each user's updates stay in order on one consumer.
+# The webhook refuses every update until TELEGRAM_WEBHOOK_SECRET is set.
+TELEGRAM_WEBHOOK_SECRET = config('TELEGRAM_WEBHOOK_SECRET', default='')
+BOT_UPDATE_QUEUE = config('BOT_UPDATE_QUEUE', default='bot:updates')
+BOT_UPDATE_SHARDS = config('BOT_UPDATE_SHARDS', default=4, cast=int)
 
 # Celery
 CELERY_BROKER_URL = config('REDIS_URL', default='redis://redis:6379/0')
 CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://redis:6379/0')
 
+# Resized copies of uploaded images (size is the longer side in pixels)
+IMAGE_VARIANTS = {
+    'thumb': {'size': 320, 'format': 'WEBP', 'quality': 80},
+    'medium': {'size': 800, 'format': 'WEBP', 'quality': 82},
+    'telegram': {'size': 1280, 'format': 'JPEG', 'quality': 85},
+}
+IMAGE_VARIANTS_ASYNC = config('IMAGE_VARIANTS_ASYNC', default=True, cast=bool)
+
 AUTH_USER_MODEL = 'shop.User'
\ No newline at end of file
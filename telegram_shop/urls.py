@@ -2,11 +2,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from shop.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('shop.urls')),
     path('bot/', include('bot.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 if settings.DEBUG: